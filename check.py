@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Checks the optimized code against straightforward implementations (those of
+# the first versions of the model), on fixed seeds:
+# rank statistics against ranks of all samples, parallel models against repeated runs,
+# time plots with time workers against a single process, quadrature against Monte Carlo,
+# poll tables and posteriors against lists of polls, invalidation of the poll cache and
+# of the results store
+# Poll checks use the poll files of the elections found in data/
+
+import argparse
+import datetime
+import os
+import shutil
+import tempfile
+from collections import Counter
+
+import numpy as np
+
+import exdata
+import polls
+from model import DirichletModel, SampleCache, RankStatistics, QuadratureStatistics, all_possible_second_rounds
+from sampling import GammaSampler
+from polls import DataCatalog, PollCollection, second_round_poll_file
+from election import Posterior, TimeElectionModel
+from outputs import ResultsStore, input_hash
+from settings import default_settings
+
+def trace(s):
+    print(s, flush=True)
+
+# Reference implementations
+
+def reference_ranks(samples):
+    "argsort in reverse order (highest score first), then argsort again to get ranks"
+    sort_indices = np.fliplr(np.argsort(samples, axis=1))
+    return np.argsort(sort_indices)
+
+def reference_probability_rank(samples, rank):
+    return np.sum(reference_ranks(samples) == rank, axis=0) / len(samples)
+
+def reference_probability_duos(samples, candidates):
+    winners = np.fliplr(np.argsort(samples, axis=1))[:, :2]
+    counts = Counter(frozenset({candidates[i], candidates[j]}) for i, j in winners)
+    return {duo: counts[duo] / len(samples) for duo in all_possible_second_rounds(candidates)}
+
+class ReferencePoll(object):
+    "A single election poll, from a row of a poll file"
+    def __init__(self, row):
+        # Missing institutes are a single institute "nan", as in poll tables
+        self.institute = str(row["sondeur"])
+        candidates = sorted(row.index[5:], key=exdata.candidates_alphabetical_index.get)
+        self.candidates = candidates
+        self.values = np.array([row[c] for c in candidates], dtype=np.float64)
+        self.date = datetime.datetime.strptime(row["date fin"], "%Y-%m-%d")
+
+def reference_polls(filename):
+    import pandas as pd
+    return [ReferencePoll(row) for i, row in pd.read_csv(filename).iterrows()]
+
+def reference_keep_latest(poll_list):
+    "Latest poll of each institute, the first in file order if several"
+    latest = {}
+    for poll in poll_list:
+        if poll.institute not in latest or poll.date > latest[poll.institute].date:
+            latest[poll.institute] = poll
+    return list(latest.values())
+
+def reference_concentration_parameters(poll_list, election_date, settings):
+    "Aposteriori concentration parameters, one poll at a time"
+    if settings["keep_only_latest"]:
+        poll_list = reference_keep_latest(poll_list)
+
+    concentration_parameters = np.ones(len(poll_list[0].values)) if poll_list else None
+    for poll in poll_list:
+        time_coeff = 1
+        if settings["election_cycle_duration"] is not None:
+            cycle_begin = election_date - datetime.timedelta(days=settings["election_cycle_duration"])
+            time_coeff = (poll.date - cycle_begin).days / settings["election_cycle_duration"]
+        concentration_parameters += (time_coeff * settings["constant_precision"] / len(poll_list)) * (poll.values / 100.0)
+    return concentration_parameters
+
+def poll_key(day, institute, values):
+    return (int(day), institute, tuple(np.round(values, 10)))
+
+# Checks
+
+def check_rank_statistics(rng):
+    "Rank statistics in blocks, at all depths, against ranks of all samples"
+    for size in [2, 3, 7, 12]:
+        weights = rng.uniform(1, 50, size)
+        samples = rng.dirichlet(weights, 10000)
+        for depth in sorted({2, 3, size}):
+            if depth > size:
+                continue
+            statistics = RankStatistics(size, depth)
+            for begin in range(0, len(samples), 3000):
+                statistics.add(samples[begin:begin + 3000])
+
+            for rank in range(statistics.depth):
+                assert np.array_equal(statistics.probability_rank(rank), reference_probability_rank(samples, rank)), \
+                    "Rank {} of {} candidates, depth {}".format(rank, size, depth)
+
+            candidates = ["c{}".format(i) for i in range(size)]
+            duos = statistics.probability_duos()
+            reference = reference_probability_duos(samples, candidates)
+            for i in range(size):
+                for j in range(i + 1, size):
+                    assert duos[i, j] == reference[frozenset({candidates[i], candidates[j]})], \
+                        "Duo {} {} of {} candidates, depth {}".format(i, j, size, depth)
+    trace("Rank statistics: same counts as ranks of all samples")
+
+def check_models(rng):
+    "Queries of models against the same samples, with and without blocks"
+    candidates = ["c{}".format(i) for i in range(6)]
+    weights = rng.uniform(1, 80, len(candidates))
+    reference = GammaSampler(1958).draw(weights, 20000)
+    ref = rng.uniform(0.05, 0.25, len(candidates))
+    for block_size in [None, 20000]:
+        # Streamed samples are drawn again by each query, from a new model
+        def model():
+            return DirichletModel(candidates, weights, 20000, sampler=GammaSampler(1958), block_size=block_size,
+                                  cache=SampleCache(budget=2**30))
+
+        ranked = model()
+        for rank in range(len(candidates)):
+            assert np.array_equal(ranked.probability_rank(rank), reference_probability_rank(reference, rank)), \
+                "Rank {}, block size {}".format(rank, block_size)
+        assert ranked.probability_duos() == reference_probability_duos(reference, candidates), "Duos, block size {}".format(block_size)
+        assert np.array_equal(model().probability_better_than(ref), np.sum(reference > ref, axis=0) / len(reference)), \
+            "Better than, block size {}".format(block_size)
+    trace("Models: same probabilities as from all samples")
+
+def check_parallel(rng):
+    "Models sampled by worker processes, same counts on repeated runs with the same seed and workers"
+    candidates = ["c{}".format(i) for i in range(5)]
+    weights = rng.uniform(1, 80, len(candidates))
+    for workers, block_size in [(2, None), (3, 7000)]:
+        def statistics():
+            model = DirichletModel(candidates, weights, 30000, sampler=GammaSampler(1958), block_size=block_size,
+                                   workers=workers)
+            return model.rank_statistics()
+
+        first, second = statistics(), statistics()
+        assert first.number_of_samples == 30000, "All samples drawn, {} workers".format(workers)
+        assert np.array_equal(first.rank_counts, second.rank_counts) and np.array_equal(first.duo_counts, second.duo_counts), \
+            "Repeated run, {} workers, block size {}".format(workers, block_size)
+    trace("Parallel models: same counts on repeated runs")
+
+def check_quadrature(rng):
+    "Quadrature against Monte Carlo, within 5 standard errors"
+    number_of_samples = 400000
+    for size in [2, 4, 8, 12]:
+        weights = rng.uniform(1, 300, size)
+        quadrature = QuadratureStatistics(weights, tolerance=1e-7)
+        statistics = RankStatistics(size)
+        statistics.add(rng.dirichlet(weights, number_of_samples))
+
+        p = np.concatenate([statistics.probability_rank(r) for r in range(size)] + [np.triu(statistics.probability_duos(), 1).ravel()])
+        q = np.concatenate([quadrature.probability_rank(r) for r in range(size)] + [quadrature.probability_duos().ravel()])
+        bound = 5 * np.sqrt(np.maximum(p * (1 - p), 1 / number_of_samples) / number_of_samples) + 1e-6
+        assert np.all(np.abs(p - q) <= bound), "{} candidates: largest difference {}".format(size, np.max(np.abs(p - q)))
+        assert np.allclose(np.sum(quadrature.rank_probabilities, axis=0), 1, atol=1e-6), "Ranks of {} candidates".format(size)
+    trace("Quadrature: same probabilities as Monte Carlo")
+
+def poll_files(election):
+    "All first and second round poll files of an election"
+    filenames = [filename for date, filename in election["first_round_filenames"]]
+    catalog = DataCatalog(election)
+    for table in catalog.first_round_tables():
+        for duo in all_possible_second_rounds(table.candidates):
+            filename = second_round_poll_file(election["second_round_prefix"], duo)
+            if os.path.isfile(filename) and filename not in filenames:
+                filenames.append(filename)
+    return filenames
+
+def check_poll_tables(election_date, filename):
+    "Tables until each date, their latest polls and posteriors against lists of polls"
+    table = polls.parse_poll_file(filename)
+    poll_list = reference_polls(filename)
+    assert len(table) == len(poll_list), filename
+    assert list(table.days) == sorted(table.days), "{} sorted by date".format(filename)
+
+    settings_variants = [dict(default_settings, keep_only_latest=keep_only_latest) for keep_only_latest in [True, False]]
+    posteriors = [Posterior(table.candidates, election_date, settings) for settings in settings_variants]
+    previous = 0
+
+    days = sorted(set(table.days))
+    limits = [days[0] - 1] + days + [days[-1] + 1]
+    for day in limits:
+        limit_date = datetime.datetime.fromordinal(int(day))
+        until = table.until(limit_date)
+        kept = [poll for poll in poll_list if poll.date <= limit_date]
+        assert sorted(poll_key(d, until.institute_names[i], v) for d, i, v in zip(until.days, until.institutes, until.values)) == \
+            sorted(poll_key(p.date.toordinal(), p.institute, p.values) for p in kept), "{} until {}".format(filename, limit_date)
+
+        # Latest polls of a prefix share the structure of the whole table, built once
+        assert np.shares_memory(until.prefix_latest(), table.prefix_latest()), "{} shared until {}".format(filename, limit_date)
+        latest = until[until.latest_per_institute()]
+        assert sorted(poll_key(d, latest.institute_names[i], v) for d, i, v in zip(latest.days, latest.institutes, latest.values)) == \
+            sorted(poll_key(p.date.toordinal(), p.institute, p.values) for p in reference_keep_latest(kept)), \
+            "{} latest until {}".format(filename, limit_date)
+
+        # Posteriors carried forward, only adding new polls
+        for posterior, settings in zip(posteriors, settings_variants):
+            posterior.add(table[previous:len(until)])
+            if kept:
+                reference = reference_concentration_parameters(kept, election_date, settings)
+                assert np.allclose(posterior.concentration_parameters(), reference, rtol=1e-12), \
+                    "{} posterior until {}, keep_only_latest={}".format(filename, limit_date, settings["keep_only_latest"])
+        previous = len(until)
+
+def check_polls(elections):
+    checked = 0
+    for year, election in sorted(elections.items()):
+        if not os.path.isdir(election["second_round_prefix"]):
+            trace("Polls {}: no poll files, skipped".format(year))
+            continue
+        for filename in poll_files(election):
+            is_first_round = filename in [f for date, f in election["first_round_filenames"]]
+            check_poll_tables(election["date_first_round" if is_first_round else "date_second_round"], filename)
+            checked += 1
+    trace("Poll tables: same polls, latest polls and posteriors as lists of polls ({} files)".format(checked))
+
+def check_time_workers(elections):
+    "Time plot dates computed by worker processes against the same dates in this process"
+    settings = dict(default_settings, sampler="numpy", number_of_samples_base=20000, number_of_samples_time_plot=20000)
+    for year, election in sorted(elections.items()):
+        if not os.path.isdir(election["second_round_prefix"]):
+            trace("Time workers {}: no poll files, skipped".format(year))
+            continue
+        poll_collection = PollCollection(election, election["first_round_filenames"][-1][1])
+        dates, single = TimeElectionModel(election, poll_collection, settings).total_win_probabilities()
+        parallel_dates, parallel = TimeElectionModel(election, poll_collection, dict(settings, time_workers=2)).total_win_probabilities()
+        assert np.array_equal(dates, parallel_dates), "Time workers {}: dates".format(year)
+        assert np.allclose(single, parallel, rtol=0, atol=1e-15), \
+            "Time workers {}: largest difference {}".format(year, np.max(np.abs(single - parallel)))
+    trace("Time workers: same probabilities as in a single process")
+
+def check_poll_cache(filename, directory):
+    "Cached tables are used while valid, and read again when their file changes"
+    previous_directory = polls.poll_cache_directory
+    polls.poll_cache_directory = os.path.join(directory, "polls")
+    try:
+        copy = os.path.join(directory, os.path.basename(filename))
+        shutil.copyfile(filename, copy)
+
+        def same(a, b):
+            return (a.candidates == b.candidates and np.array_equal(a.values, b.values) and np.array_equal(a.days, b.days)
+                    and [a.institute_names[i] for i in a.institutes] == [b.institute_names[i] for i in b.institutes])
+
+        parsed = polls.parse_poll_file(copy)
+        table, content_hash = polls.read_poll_file(copy)
+        assert same(table, parsed) and os.listdir(polls.poll_cache_directory), "First read is parsed and cached"
+        table, cached_hash = polls.read_poll_file(copy)
+        assert same(table, parsed) and cached_hash == content_hash, "Second read from the cache"
+
+        # Touched: same content, same hash
+        stat = os.stat(copy)
+        os.utime(copy, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        table, touched_hash = polls.read_poll_file(copy)
+        assert same(table, parsed) and touched_hash == content_hash, "Touched file"
+
+        # Changed with the same size: only the hash tells
+        with open(copy) as f:
+            lines = f.read().split("\n")
+        lines[1], lines[2] = lines[2], lines[1]
+        with open(copy, "w") as f:
+            f.write("\n".join(lines))
+        os.utime(copy, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10**9))
+        table, changed_hash = polls.read_poll_file(copy)
+        assert changed_hash != content_hash and same(table, polls.parse_poll_file(copy)), "Changed file, same size"
+
+        # Removed poll
+        with open(copy, "w") as f:
+            f.write("\n".join(lines[:1] + lines[2:]))
+        table, removed_hash = polls.read_poll_file(copy)
+        assert same(table, polls.parse_poll_file(copy)) and len(table) == len(parsed) - 1, "Removed poll"
+
+        # Older cache format
+        polls.poll_cache_version += 1
+        try:
+            table, version_hash = polls.read_poll_file(copy)
+            cache_file = polls.poll_cache_file(copy)
+            with np.load(cache_file) as cached:
+                assert int(cached["version"]) == polls.poll_cache_version, "Cache of an older version is written again"
+        finally:
+            polls.poll_cache_version -= 1
+
+        # Truncated and unreadable cache files
+        cache_file = polls.poll_cache_file(copy)
+        with open(cache_file, "rb") as f:
+            truncated = f.read()[:300]
+        for content in [truncated, b"", b"not a cache file"]:
+            with open(cache_file, "wb") as f:
+                f.write(content)
+            table, content_hash = polls.read_poll_file(copy)
+            assert same(table, polls.parse_poll_file(copy)), "Unreadable cache file: {!r}".format(content[:20])
+    finally:
+        polls.poll_cache_directory = previous_directory
+    trace("Poll cache: read again when files change")
+
+def check_results_store(directory):
+    "Stored results are found with the same inputs only, and older ones removed"
+    store = ResultsStore(os.path.join(directory, "results"))
+    settings = dict(default_settings)
+    key = input_hash("files", settings, modules=[])
+    assert key == input_hash("files", dict(reversed(list(settings.items()))), modules=[]), "Same hash whatever the dict order"
+    assert key != input_hash("files", dict(settings, constant_precision=401), modules=[]), "Settings change the hash"
+    assert key != input_hash("other files", settings, modules=[]), "Files change the hash"
+    assert input_hash(np.arange(3)) != input_hash(np.arange(3, dtype=np.int32)), "Array types change the hash"
+    assert input_hash(1) != input_hash(1, modules=["model.py"]), "Code changes the hash"
+
+    assert store.get("2017-models", key) is None, "Empty store"
+    store.put("2017-models", key, {"a": np.arange(3)})
+    assert np.array_equal(store.get("2017-models", key)["a"], np.arange(3)), "Stored results"
+    other_key = input_hash("changed files", settings, modules=[])
+    assert store.get("2017-models", other_key) is None, "Other inputs"
+    store.put("2017-models", other_key, {"a": np.arange(4)})
+    assert store.get("2017-models", key) is None, "Older results removed"
+    store.put("2017-time-series", key, 1)
+    assert store.get("2017-models", other_key) is not None, "Other names kept"
+
+    with open(store.filename("2017-models", other_key), "wb") as f:
+        f.write(b"truncated")
+    assert store.get("2017-models", other_key) is None, "Unreadable results"
+    assert not os.path.exists(store.filename("2017-models", other_key)), "Unreadable results removed"
+    trace("Results store: found with the same inputs only")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Depuis 1958, checks of the model against reference implementations")
+    parser.add_argument("--seed", type=int, default=1958, help="Random seed of the checks")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    check_rank_statistics(rng)
+    check_models(rng)
+    check_parallel(rng)
+    check_quadrature(rng)
+    check_polls(exdata.elections)
+    check_time_workers(exdata.elections)
+
+    directory = tempfile.mkdtemp()
+    try:
+        elections = [e for e in exdata.elections.values() if os.path.isdir(e["second_round_prefix"])]
+        if elections:
+            check_poll_cache(elections[-1]["first_round_filenames"][-1][1], directory)
+        else:
+            trace("Poll cache: no poll files, skipped")
+        check_results_store(directory)
+    finally:
+        shutil.rmtree(directory)
+    trace("All checks passed")
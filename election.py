@@ -1,122 +1,385 @@
-from collections import defaultdict
+import itertools
+import copy
+import datetime
+from collections import OrderedDict
 
 import numpy as np
+import scipy.special
 
-from model import DirichletModel, all_possible_second_rounds
+from model import DirichletModel, SampleBudget, all_possible_second_rounds, batch_duo_probabilities, process_pool, sample_cache
+from sampling import make_sampler, make_common_uniforms
 import exdata
+from polls import PollCollection, day_numbers
 
-def keep_latest_per_institute(polls):
-    latest = {}
-    for poll in polls:
-        if poll.institute not in latest:
-            latest[poll.institute] = poll
-        else:
-            if poll.date > latest[poll.institute].date:
-                latest[poll.institute] = poll
-    return list(latest.values())
-
-def build_model(candidates, poll_objects, election_date, number_of_samples, settings):
+class Posterior(object):
+    """
+    Aposteriori concentration parameters of a model, updated with tables of polls
+    With keep_only_latest, a newer poll from an institute replaces the previous one
+    """
+    def __init__(self, candidates, election_date, settings):
+        self.candidates = candidates
+        self.election_date = election_date
+        self.settings = settings
 
-    # Keep only latest
-    if settings["keep_only_latest"]:
-        kept_polls = keep_latest_per_institute(poll_objects)
-    else:
-        kept_polls = poll_objects
+        # Day number and contribution of the latest poll of each institute
+        self.latest = {}
 
-    # Dirichlet prior concentration parameters
-    # Uniform prior with large uncertainty
-    concentration_parameters = np.ones(len(candidates))
+        # Sum of time weighted poll shares over kept polls, and their number
+        self.total = np.zeros(len(candidates))
+        self.number_of_polls = 0
 
-    nk = len(kept_polls)
+        # Day number of the latest poll added: all polls up to that day make the posterior
+        self.latest_day = None
 
-    # Compute aposteriori concentration parameters given the polls' multinomial observations
-    # i.e. add all polls multinomial counts (because dirichlet is conjugate prior to multinomial)
-    for poll in kept_polls:
+    def contributions(self, table):
+        "Shares of all polls of a table weighted by their time coefficient"
         # Checks
-        assert (poll.candidates == candidates)
-        #assert (abs(np.sum(poll.values) - 100) < 1e-10)
-        if not (abs(np.sum(poll.values) - 100) < 1e-10):
+        assert (table.candidates == self.candidates)
+        #assert (np.all(np.abs(np.sum(table.values, axis=1) - 100) < 1e-10))
+        for k in np.flatnonzero(~(np.abs(np.sum(table.values, axis=1) - 100) < 1e-10)):
             print("WARNING: Poll does not sum to 100.")
 
-        if settings["election_cycle_duration"] is not None:
-            time_coeff = poll.time_coeff(election_date, settings["election_cycle_duration"])
+        if self.settings["election_cycle_duration"] is not None:
+            time_coeffs = table.time_coeffs(self.election_date, self.settings["election_cycle_duration"])
         else:
-            time_coeff = 1
-        assert (time_coeff > 0 and time_coeff <= 1)
+            time_coeffs = np.ones(len(table))
+        assert (np.all((time_coeffs > 0) & (time_coeffs <= 1)))
+
+        return time_coeffs[:, np.newaxis] * (table.values / 100.0)
+
+    def add(self, table):
+        "Update with new polls, same as adding them one at a time in the table's order of equal dates"
+        if len(table) == 0:
+            return
+
+        latest_day = np.max(table.days)
+        if self.latest_day is None or latest_day > self.latest_day:
+            self.latest_day = latest_day
+
+        if not self.settings["keep_only_latest"]:
+            self.total += np.sum(self.contributions(table), axis=0)
+            self.number_of_polls += len(table)
+            return
+
+        # Only the latest poll of each institute of the table may be kept
+        table = table[table.latest_per_institute()]
+        contributions = self.contributions(table)
+        for institute, day, contribution in zip(table.institutes, table.days, contributions):
+            name = table.institute_names[institute]
+            if name in self.latest:
+                previous_day, previous_contribution = self.latest[name]
+                if not day > previous_day:
+                    continue
+
+                # Remove the superseded poll
+                self.total -= previous_contribution
+                self.number_of_polls -= 1
+
+            self.latest[name] = (day, contribution)
+            self.total += contribution
+            self.number_of_polls += 1
+
+    def concentration_parameters(self):
+        # Dirichlet prior concentration parameters
+        # Uniform prior with large uncertainty
+        concentration_parameters = np.ones(len(self.candidates))
+
+        # Compute aposteriori concentration parameters given the polls' multinomial observations
+        # i.e. add all polls multinomial counts (because dirichlet is conjugate prior to multinomial)
+        if self.number_of_polls > 0:
+            # Non independent polls, use constant precision
+            D = self.settings["constant_precision"]
+            concentration_parameters += (D / self.number_of_polls) * self.total
+
+        return concentration_parameters
+
+    def model(self, number_of_samples, spawn_key=(), budget=None, common_uniforms=None):
+        "Model with the current parameters"
+        # Model built with parameters = candidates in alphabetical order
+        return make_model(self.candidates, self.concentration_parameters(), number_of_samples, self.settings,
+                          spawn_key, budget, common_uniforms)
+
+def make_model(candidates, concentration_parameters, number_of_samples, settings, spawn_key=(), budget=None,
+               common_uniforms=None):
+    "DirichletModel configured by settings"
+    return DirichletModel(candidates, concentration_parameters, number_of_samples,
+                          sampler=make_sampler(settings, spawn_key, common_uniforms),
+                          block_size=settings["block_size"],
+                          rank_depth=settings["rank_depth"],
+                          workers=settings["workers"],
+                          target_error=settings["target_error"],
+                          tolerance=settings["quadrature_tolerance"],
+                          budget=budget)
+
+def first_round_duo_probabilities(candidates, concentration_parameters, number_of_samples, settings, spawn_key):
+    "Duo probability matrix of a first round model, run in worker processes"
+    model = make_model(candidates, concentration_parameters, number_of_samples, settings, spawn_key)
+    duo_probabilities = model.rank_statistics().probability_duos()
+
+    # Don't keep samples in the worker
+    model.release_samples()
+    return duo_probabilities
+
+class SecondRoundModels(object):
+    """
+    Second round models shared by the main model and all first round hypotheses
+    of an election, since second round polls don't depend on the hypothesis
+    Models are keyed by duo, concentration parameters and date of the latest
+    poll (that identifies their random stream), so dates without new second
+    round polls share them too, and changed poll files give new models. Only
+    their parameters and analytic probability_win are used, so the main model
+    and time plot dates share them whatever their number of samples
+    """
+    def __init__(self):
+        self.models = {}
+
+    def model(self, election, posterior, number_of_samples):
+        "Model of a second round posterior, built once"
+        key = (election["second_round_prefix"], tuple(posterior.candidates), posterior.latest_day,
+               posterior.concentration_parameters().tobytes())
+        if key not in self.models:
+            # Random stream identified by the polls and candidates
+            day = 0 if posterior.latest_day is None else int(posterior.latest_day)
+            spawn_key = (day, 2) + tuple(exdata.candidates_alphabetical_index[c] for c in posterior.candidates)
+            self.models[key] = posterior.model(number_of_samples, spawn_key)
+        return self.models[key]
+
+    def clear(self):
+        "Forget all models, e.g. once an election is done"
+        self.models.clear()
+
+# Shared by all election models
+second_round_models = SecondRoundModels()
+
+class DuoProbabilities(object):
+    """
+    First round duo probabilities already computed, keyed by concentration
+    parameters, number of samples, random stream and settings
+    Kept for the whole process: when polls change (watch mode), dates before
+    the change have the same parameters and are not computed again. Results
+    of a time plot are stored with its series, to fill the memo again when a
+    new process starts (see entries and update)
+    Least recently used results are forgotten beyond max_entries, so that a
+    long running process doesn't grow without bound
+    """
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.results = OrderedDict()
+
+    def key(self, concentration_parameters, number_of_samples, spawn_key, settings):
+        return (np.asarray(concentration_parameters).tobytes(), number_of_samples, spawn_key,
+                tuple(sorted(settings.items())))
+
+    def lookup(self, key):
+        "Result already computed, None if there is none"
+        if key not in self.results:
+            return None
+        self.results.move_to_end(key)
+        return self.results[key]
+
+    def put(self, key, result):
+        self.results[key] = result
+        self.results.move_to_end(key)
+        while len(self.results) > self.max_entries:
+            self.results.popitem(last=False)
+
+    def entries(self, keys):
+        "Results of some keys, those forgotten or never computed are left out"
+        return {key: self.results[key] for key in keys if key in self.results}
+
+    def update(self, entries):
+        "Add results computed before, e.g. by another process"
+        for key, result in entries.items():
+            self.put(key, result)
+
+    def get(self, key, compute):
+        "Memoized result of compute(), always computed if key is None"
+        if key is None:
+            return compute()
+        result = self.lookup(key)
+        if result is None:
+            result = compute()
+            self.put(key, result)
+        return result
+
+# Shared by all election models, a few times the dates of all time plots
+duo_probabilities_memo = DuoProbabilities(max_entries=10000)
+
+def second_round_candidates(duo):
+    "Candidates of a second round model, in alphabetical order"
+    return sorted(duo, key=exdata.candidates_alphabetical_index.get)
+
+class SecondRoundBank(object):
+    """
+    All second round models as arrays, to compute their win probabilities at once
+    Duo k is candidates[first[k]] against candidates[second[k]], in the same
+    order as the upper triangle of the first round duo probability matrix
+    second_rounds is {duo: (second round candidates, concentration parameters)}, where
+    parameters may have leading dimensions (e.g. one row per date), kept in all results
+    """
+    def __init__(self, candidates, second_rounds):
+        self.candidates = candidates
+        self.first, self.second = np.array(list(itertools.combinations(range(len(candidates)), 2))).T
+        self.duos = [frozenset({candidates[i], candidates[j]}) for i, j in zip(self.first, self.second)]
+
+        # Concentration parameters of the first and second candidate of each duo
+        alphas, betas = [], []
+        for duo, i, j in zip(self.duos, self.first, self.second):
+            duo_candidates, weights = second_rounds[duo]
+            alphas.append(weights[..., duo_candidates.index(candidates[i])])
+            betas.append(weights[..., duo_candidates.index(candidates[j])])
+        self.alphas = np.stack(alphas, axis=-1)
+        self.betas = np.stack(betas, axis=-1)
+
+    def rows(self, selection):
+        "Bank restricted to some rows of parameters"
+        bank = copy.copy(self)
+        bank.alphas = self.alphas[selection]
+        bank.betas = self.betas[selection]
+        return bank
+
+    def probability_win(self):
+        "Probability that the first candidate of each duo wins its second round"
+        # Score of first is Beta(alpha, beta), and P(Beta(a, b) > 0.5) = I_0.5(b, a)
+        return scipy.special.betainc(self.betas, self.alphas, 0.5)
 
-        # Non independent polls, use constant precision
-        D = settings["constant_precision"]
+    def probability_win_duo(self, duo):
+        "Probabilities of each candidate of a duo to win its second round, and the candidates"
+        k = self.duos.index(duo)
+        win_prob = self.probability_win()[..., k]
+        candidates = [self.candidates[self.first[k]], self.candidates[self.second[k]]]
+        return candidates, np.stack((win_prob, 1 - win_prob), axis=-1)
 
-        # Bayesian updating
-        concentration_parameters += (time_coeff * D/nk) * (poll.values / 100.0)
+    def total_win_probabilities(self, duo_probabilities):
+        """
+        Total win probability vectors, given the matrices of first round duo probabilities
+        sum( P( win | second round ) * P( second round ) )
+        """
+        prob_duos = duo_probabilities[..., self.first, self.second]
+        win_prob = self.probability_win()
 
-    # Model built with parameters = candidates in alphabetical order
-    model = DirichletModel(candidates, concentration_parameters, number_of_samples)
-    return model
+        # Add each duo's contribution to both its candidates
+        N = len(self.candidates)
+        first = np.eye(N)[self.first]
+        second = np.eye(N)[self.second]
+        return (win_prob * prob_duos) @ first + ((1 - win_prob) * prob_duos) @ second
 
 class ElectionModel(object):
     """
     Statistical model for a two-round majority voting election
+    posteriors is an optional pair (first round Posterior, {duo: second round Posterior})
+    already updated with all polls up to limit_date, otherwise they are built from poll_collection
+    With common_uniforms (sampling.CommonUniforms), the first round model draws
+    them, e.g. the same ones as other dates of a time plot
     """
-    def __init__(self, election, poll_collection, limit_date, number_of_samples, settings):
+    def __init__(self, election, poll_collection, limit_date, number_of_samples, settings, budget=None, posteriors=None,
+                 common_uniforms=None):
         self.election = election
         self.poll_collection = poll_collection
         self.candidates = poll_collection.candidates
 
-        # Build first round model
-        self.model_first_round = build_model(poll_collection.candidates,
-                                             poll_collection.get_first_rounds(limit_date),
-                                             election["date_first_round"],
-                                             number_of_samples,
-                                             settings)
+        if posteriors is None:
+            posterior_first_round = Posterior(self.candidates, election["date_first_round"], settings)
+            posterior_first_round.add(poll_collection.get_first_rounds(limit_date))
 
-        # Build second round models
+            posteriors_second_rounds = {}
+            for duo in all_possible_second_rounds(self.candidates):
+                posteriors_second_rounds[duo] = Posterior(second_round_candidates(duo), election["date_second_round"], settings)
+                posteriors_second_rounds[duo].add(poll_collection.get_second_rounds(duo, limit_date))
+        else:
+            posterior_first_round, posteriors_second_rounds = posteriors
+
+        # Build first round model, its random stream is identified by date and round
+        day = limit_date.toordinal()
+        self.model_first_round = posterior_first_round.model(number_of_samples, spawn_key=(day, 1), budget=budget,
+                                                             common_uniforms=common_uniforms)
+
+        # Results drawn from a shared sample budget depend on other models
+        self.duo_key = None
+        if budget is None:
+            self.duo_key = duo_probabilities_memo.key(self.model_first_round.weights, number_of_samples, (day, 1), settings)
+
+        # Get second round models, shared with other hypotheses and dates
         self.models_second_rounds = {}
-        for duo in all_possible_second_rounds(poll_collection.candidates):
-            candidates = sorted(duo, key=exdata.candidates_alphabetical_index.get)
-            self.models_second_rounds[duo] = build_model(candidates,
-                                                         poll_collection.get_second_rounds(duo, limit_date),
-                                                         election["date_second_round"],
-                                                         number_of_samples,
-                                                         settings)
+        for duo, posterior in posteriors_second_rounds.items():
+            self.models_second_rounds[duo] = second_round_models.model(election, posterior, number_of_samples)
+
+        self.second_round_bank = SecondRoundBank(self.candidates, {
+            duo: (model.candidates, model.weights) for duo, model in self.models_second_rounds.items()
+        })
 
     def total_win_probability(self):
         "Total winning chances after both rounds"
-        totals =  defaultdict(np.float64)
         # TODO also add win prob at first round
+        duo_probabilities = duo_probabilities_memo.get(self.duo_key, lambda: self.model_first_round.rank_statistics().probability_duos())
+        totals = self.second_round_bank.total_win_probabilities(duo_probabilities)
+        return dict(zip(self.candidates, totals))
 
-        prob_duos = self.model_first_round.probability_duos()
+class TimeElectionModel(object):
+    """
+    ElectionModel function of time
+    Posteriors are carried forward from one date to the next, only adding the
+    polls released in between (time coefficients don't depend on the date)
+    With the batched_time_sweep setting, no ElectionModel is built (election_models
+    is None): parameters of all dates are kept as matrices and sampled at once
+    With the common_random_numbers setting, all dates draw the same base uniforms
+    With time_workers > 1, no ElectionModel is built either: first round models of
+    dates are built by worker processes, that only send back duo probabilities
+    Only dates in [begin, end) are modelled (None for no bound), e.g. the dates
+    where a first round hypothesis is plotted. Earlier polls are still counted
+    """
+    def __init__(self, election, poll_collection, settings, quick=False, begin=None, end=None):
+        # Get list of fake_todays from first round file, keep those in the window
+        all_poll_dates = poll_collection.fake_today_poll_dates()
+        self.poll_dates = all_poll_dates
+        if begin is not None:
+            self.poll_dates = self.poll_dates[self.poll_dates >= begin]
+        if end is not None:
+            self.poll_dates = self.poll_dates[self.poll_dates < end]
 
-        # For each candidate, the total win probability is:
-        #     sum( P( win | second round ) * P( second round ) )
-        # So, compute this sum for each candidate by adding each possible second
-        # round's contribution to both participating candidates total probabilities
-        for duo in self.models_second_rounds.keys():
-            c1, c2 = duo
+        self.candidates = poll_collection.candidates
+        self.settings = settings
+        self.quick = quick
+        # Parameters of all dates are kept instead of models in batched and parallel modes
+        keep_parameters = settings["batched_time_sweep"] or settings["time_workers"] > 1
+        self.election_models = None if keep_parameters else []
 
-            # The order between c1 and c2 is unknown here, so get it with .index()
-            index_c1 = self.models_second_rounds[duo].candidates.index(c1)
-            index_c2 = self.models_second_rounds[duo].candidates.index(c2)
+        # Memo keys of the duo probabilities of dates computed, see DuoProbabilities.entries
+        self.duo_keys = []
 
-            # Add contribution of this possible second round to each candidate's total probability
-            win_prob = self.models_second_rounds[duo].probability_win()
-            totals[c1] += win_prob[index_c1] * prob_duos[duo]
-            totals[c2] += win_prob[index_c2] * prob_duos[duo]
-        return totals
+        # In adaptive mode, all dates draw from the same total number of samples
+        budget = None
+        if settings["target_error"] is not None and settings["sample_budget"] is not None:
+            budget = SampleBudget(settings["sample_budget"])
 
+        # Uniforms drawn once for the whole sweep, transformed by each date
+        self.common_uniforms = None
+        if settings["common_random_numbers"]:
+            self.common_uniforms = make_common_uniforms(settings, spawn_key=(0, 0))
 
-class TimeElectionModel(object):
-    "ElectionModel function of time"
-    def __init__(self, election, poll_collection, settings, quick=False):
-        # Get list of fake_todays from first round file
-        self.poll_dates = poll_collection.fake_today_poll_dates()
+        # Posteriors and their polls (sorted by date), not yet added
+        posterior_first_round = Posterior(self.candidates, election["date_first_round"], settings)
+        pending = [(posterior_first_round, poll_collection.polls_first_round)]
+        posteriors_second_rounds = {}
+        for duo, polls in poll_collection.polls_second_round.items():
+            posteriors_second_rounds[duo] = Posterior(second_round_candidates(duo), election["date_second_round"], settings)
+            pending.append((posteriors_second_rounds[duo], polls))
+        positions = [0] * len(pending)
 
-        self.candidates = poll_collection.candidates
-        self.election_models = []
+        # Parameters of all dates, in batched and parallel modes
+        first_round_parameters = []
+        second_round_parameters = {duo: [] for duo in posteriors_second_rounds}
+        self.numbers_of_samples = []
 
         for date in self.poll_dates:
 
-            if date == self.poll_dates[-1]:
+            # Add polls released since the previous date
+            for k, (posterior, polls) in enumerate(pending):
+                stop = np.searchsorted(polls.days, date.toordinal(), side="right")
+                posterior.add(polls[positions[k]:stop])
+                positions[k] = stop
+
+            if date == all_poll_dates[-1]:
                 number_of_samples = settings["number_of_samples_base"]
             else:
                 number_of_samples = settings["number_of_samples_time_plot"]
@@ -124,5 +387,188 @@ class TimeElectionModel(object):
             if quick:
                 number_of_samples = 2000
 
-            election_model = ElectionModel(election, poll_collection, date, number_of_samples, settings)
+            if keep_parameters:
+                first_round_parameters.append(posterior_first_round.concentration_parameters())
+                for duo, posterior in posteriors_second_rounds.items():
+                    second_round_parameters[duo].append(posterior.concentration_parameters())
+                self.numbers_of_samples.append(number_of_samples)
+                continue
+
+            election_model = ElectionModel(election, poll_collection, date, number_of_samples, settings, budget,
+                                           posteriors=(posterior_first_round, posteriors_second_rounds),
+                                           common_uniforms=self.common_uniforms)
             self.election_models.append(election_model)
+
+        if keep_parameters:
+            self.first_round_parameters = np.array(first_round_parameters).reshape((-1, len(self.candidates)))
+            self.second_round_bank = SecondRoundBank(self.candidates, {
+                duo: (posteriors_second_rounds[duo].candidates, np.array(parameters).reshape((-1, 2)))
+                for duo, parameters in second_round_parameters.items()
+            })
+
+    def total_win_probabilities(self, begin=None, end=None):
+        """
+        Total win probabilities of dates in [begin, end) (None for no bound)
+        Returns the dates, and probabilities with one row per date and one column per candidate
+        """
+        selected = np.ones(len(self.poll_dates), dtype=bool)
+        if begin is not None:
+            selected &= self.poll_dates >= begin
+        if end is not None:
+            selected &= self.poll_dates < end
+
+        if self.election_models is not None:
+            probabilities = []
+            for election_model, s in zip(self.election_models, selected):
+                if s:
+                    total_win_probability = election_model.total_win_probability()
+                    probabilities.append([total_win_probability[c] for c in self.candidates])
+                    if election_model.duo_key is not None:
+                        self.duo_keys.append(election_model.duo_key)
+                    # Each date is only queried once, don't keep its samples
+                    election_model.model_first_round.release_samples()
+            return self.poll_dates[selected], np.array(probabilities).reshape((-1, len(self.candidates)))
+
+        if not np.any(selected):
+            return self.poll_dates[selected], np.zeros((0, len(self.candidates)))
+
+        if self.settings["batched_time_sweep"]:
+            duo_probabilities = self.batch_duo_probabilities(selected)
+        else:
+            duo_probabilities = self.parallel_duo_probabilities(selected)
+        probabilities = self.second_round_bank.rows(selected).total_win_probabilities(duo_probabilities)
+        return self.poll_dates[selected], probabilities
+
+    def batch_duo_probabilities(self, selected):
+        "First round duo probabilities of selected dates, all sampled at once with the same number of samples"
+        number_of_samples = 2000 if self.quick else self.settings["number_of_samples_time_plot"]
+        # Stream distinct from those of per date models, keyed by a day > 0
+        sampler = make_sampler(self.settings, spawn_key=(0,), common_uniforms=self.common_uniforms)
+        return batch_duo_probabilities(self.first_round_parameters[selected], number_of_samples, sampler,
+                                       self.settings["block_size"], self.settings["quadrature_tolerance"])
+
+    def parallel_duo_probabilities(self, selected):
+        """
+        First round duo probabilities of selected dates, one worker process job per date
+        Same models and random streams as ElectionModel, so same results as without workers
+        """
+        # Each job samples in a single process
+        settings = dict(self.settings, workers=1)
+
+        # Only dates not computed before are sent
+        keys = {}
+        for k in np.flatnonzero(selected):
+            spawn_key = (self.poll_dates[k].toordinal(), 1)
+            keys[k] = duo_probabilities_memo.key(self.first_round_parameters[k], self.numbers_of_samples[k], spawn_key, self.settings)
+
+        pool = process_pool(self.settings["time_workers"])
+        duo_probabilities = {k: duo_probabilities_memo.lookup(key) for k, key in keys.items()}
+        futures = {k: pool.submit(first_round_duo_probabilities, self.candidates, self.first_round_parameters[k],
+                                  self.numbers_of_samples[k], settings, keys[k][2])
+                   for k, result in duo_probabilities.items() if result is None}
+        for k, future in futures.items():
+            duo_probabilities[k] = future.result()
+            duo_probabilities_memo.put(keys[k], duo_probabilities[k])
+        self.duo_keys.extend(keys.values())
+
+        return np.array([duo_probabilities[k] for k in keys]).reshape((-1, len(self.candidates), len(self.candidates)))
+
+    def second_round_win_probabilities(self, duo):
+        "Candidates of a second round, and their win probabilities with one row per date"
+        if self.election_models is not None:
+            model = self.election_models[0].models_second_rounds[duo]
+            return model.candidates, np.array([election_model.models_second_rounds[duo].probability_win()
+                                               for election_model in self.election_models])
+        return self.second_round_bank.probability_win_duo(duo)
+
+def equivalent_score_2012(candidates, results_2012):
+    "Vector of scores in 2012 election (thyself or party equivalent)"
+    scores = np.zeros(len(candidates))
+    for i, c in enumerate(candidates):
+        if c in results_2012.keys():
+            scores[i] = results_2012[c] / 100
+        elif c in exdata.candidates_2012_equivalents.keys():
+            scores[i] = results_2012[exdata.candidates_2012_equivalents[c]] / 100
+    return scores
+
+def model_results(election, settings, catalog):
+    """
+    Results of the main election model with the latest hypothesis, only
+    numbers and candidates so that they don't depend on how they are shown
+    "duos" has, for each duo, its probability, the candidates of its second
+    round, their win probabilities and whether it has polls
+    Violins are (candidates, marginal parameters, means, ground truth), the
+    second round ones only for duos with polls
+    """
+    first_round_filename = election["first_round_filenames"][-1][1]
+    poll_collection = PollCollection(election, first_round_filename, catalog)
+    election_model = ElectionModel(election, poll_collection, election["date_second_round"], settings["number_of_samples_base"], settings)
+    model = election_model.model_first_round
+
+    results = {}
+    results["number_of_valid_polls"] = poll_collection.number_of_first_round_polls() + poll_collection.number_of_second_round_polls()
+    results["total_win_probability"] = election_model.total_win_probability()
+
+    results["duos"] = {}
+    for duo, prob_duo in model.probability_duos().items():
+        second_round = election_model.models_second_rounds[duo]
+        results["duos"][duo] = (prob_duo, second_round.candidates, second_round.probability_win(), second_round.sum() > 2)
+
+    results_2012 = exdata.elections["2012"]["official_results"]
+    results["individuals"] = {
+        "candidates": model.candidates,
+        "second_round": model.probability_second_round(),
+        "third": model.probability_rank(2), # rank is 0-based here
+        "better_than_2012": model.probability_better_than(equivalent_score_2012(model.candidates, results_2012)),
+    }
+
+    results["first_round_violin"] = (model.candidates, model.marginal_parameters(), model.mean(), election["official_results"])
+    results["second_round_violins"] = []
+    for duo, conditional_model in election_model.models_second_rounds.items():
+        ground_truth = None
+        if election["official_results_second_round"] and duo == frozenset(election["official_results_second_round"].keys()):
+            ground_truth = election["official_results_second_round"]
+        if conditional_model.sum() > 2:
+            results["second_round_violins"].append((conditional_model.candidates, conditional_model.marginal_parameters(),
+                                                    conditional_model.mean(), ground_truth))
+
+    # All queries on the main model are done, free its samples
+    model.release_samples()
+
+    return results
+
+def time_series(election, settings, quick, catalog):
+    """
+    Series of the time plot of an election, as day numbers and probabilities
+    "first_round" has the candidates, days and total win probabilities of each
+    hypothesis, only until the next one begins. "second_round" has the
+    candidates, days and conditional win probabilities of the winning duo, or
+    is None if there is no poll after the first round
+    "duo_probabilities" has the first round duo probabilities of all dates
+    computed, as entries of duo_probabilities_memo
+    """
+    # Each hypothesis is only plotted until the next one begins
+    dates = [date for date, first_round_filename in election["first_round_filenames"]]
+    ends = dates[1:] + [election["date_second_round"] + datetime.timedelta(1)]
+    first_round = []
+    duo_keys = []
+    for (date, first_round_filename), end in zip(election["first_round_filenames"], ends):
+        time_election_model = TimeElectionModel(election, PollCollection(election, first_round_filename, catalog), settings, quick, date, end)
+        poll_dates, win_probs = time_election_model.total_win_probabilities(date, end)
+        first_round.append((time_election_model.candidates, day_numbers(poll_dates), win_probs))
+        duo_keys.extend(time_election_model.duo_keys)
+
+    second_round = None
+    if election["official_results_second_round"] is not None:
+        winning_duo = frozenset(election["official_results_second_round"].keys())
+        # The last hypothesis, but conditional models are the same
+        poll_dates = time_election_model.poll_dates
+        if poll_dates.max() > election["date_first_round"]:
+            candidates, cond_win_probs = time_election_model.second_round_win_probabilities(winning_duo)
+            second_round = (candidates, day_numbers(poll_dates), cond_win_probs)
+
+    # Time models samples are not needed anymore
+    sample_cache.clear()
+
+    return {"first_round": first_round, "second_round": second_round,
+            "duo_probabilities": duo_probabilities_memo.entries(duo_keys)}
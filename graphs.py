@@ -7,6 +7,9 @@ from collections import defaultdict
 import numpy as np
 import scipy
 import scipy.interpolate
+import scipy.stats
+import matplotlib
+matplotlib.use("Agg") # Only render to files, also in worker processes without display
 from matplotlib import font_manager
 import matplotlib.pyplot as plt
 from matplotlib.dates import drange, date2num, WeekdayLocator, DayLocator, DateFormatter, SUNDAY
@@ -14,29 +17,36 @@ from matplotlib.ticker import FuncFormatter, NullFormatter
 import pandas as pd
 
 from model import argsort, sortby, sortbyx
+from polls import days_to_dates
 import exdata
 
-def violin_vert(model, filename, title, ground_truth=None):
+def violin_vert(filename, candidates, marginal_parameters, means, title=None, ground_truth=None):
+    """
+    Violins of the marginal beta distributions of a Dirichlet model
+    Only takes the model's candidates, marginal_parameters() and mean(), so
+    that it can run in a worker process without the model
+    """
     plt.style.use("seaborn-white")
     fig = plt.figure(figsize=(11,6))
     ax = fig.add_subplot(1, 1, 1)
 
-    positions = range(1, model.size + 1)
+    size = len(candidates)
+    positions = range(1, size + 1)
 
     width = 0.5
     Q = 0.001
     number_of_points = 1000
 
-    for c in model.candidates:
+    for c in candidates:
         if c not in exdata.candidates_left_right_index:
             print("missing:", c)
 
-    indexes = argsort(model.candidates, key=exdata.candidates_left_right_index.get)
+    indexes = argsort(candidates, key=exdata.candidates_left_right_index.get)
     #indexes = argsort(candidates, key=exdata.candidates_alphabetical_index.get)
-    candidates = sortby(model.candidates, indexes)
+    candidates = sortby(candidates, indexes)
 
     # Violins
-    alphas, betas = sortbyx(model.marginal_parameters(), indexes)
+    alphas, betas = sortbyx(marginal_parameters, indexes)
 
     lowers = scipy.stats.beta.ppf(Q, alphas, betas)
     highers = scipy.stats.beta.ppf(1-Q, alphas, betas)
@@ -54,10 +64,10 @@ def violin_vert(model, filename, title, ground_truth=None):
         art.set_edgecolor("k") # workaround https://github.com/matplotlib/matplotlib/issues/5423
 
     # Mean and mode lines
-    widths = [width] * model.size
+    widths = [width] * size
     pmins = -0.25 * np.array(widths) + positions
     pmaxes = 0.25 * np.array(widths) + positions
-    ax.hlines(sortby(model.mean(), indexes), pmins, pmaxes, colors="k", linestyle="-", linewidth=1, alpha=1)
+    ax.hlines(sortby(means, indexes), pmins, pmaxes, colors="k", linestyle="-", linewidth=1, alpha=1)
     #ax.hlines(sortby(model.mode(), indexes), pmins, pmaxes, colors="k", linestyle="-", linewidth=1, alpha=0.5)
 
     if ground_truth is not None:
@@ -90,11 +100,11 @@ def violin_vert(model, filename, title, ground_truth=None):
         label.set_fontproperties(ticks_font)
 
     # Plot limits
-    if len(model.candidates) > 2:
+    if size > 2:
         ax.set_ylim([0, 0.40])
     else:
         ax.set_ylim([0.30, 0.70])
-    ax.set_xlim([0.5, model.size + 0.5])
+    ax.set_xlim([0.5, size + 0.5])
 
     # Grid
     ax.grid(True, axis="y", which='major', linestyle="-", linewidth=1, color=(0.6, 0.6, 0.6))
@@ -112,7 +122,7 @@ def violin_vert(model, filename, title, ground_truth=None):
     ax.yaxis.set_ticks_position('none')
     ax.xaxis.set_ticks_position('none')
 
-    fig.savefig(filename, dpi=300, bbox_inches="tight")
+    fig.savefig(filename, dpi=300, bbox_inches="tight", format="png")
     plt.close(fig)
 
 events = {
@@ -145,28 +155,27 @@ text_black = (0, 0, 0)
 background_gray = (0.55, 0.55, 0.55)
 small_text = 9
 
-def time_plot(filename, election, dated_time_election_models, winning_duo, interpolation):
+def time_plot(filename, election, first_round_series, second_round_series, interpolation):
+    """
+    Win probabilities over time
+    first_round_series are (candidates, day numbers, total win probabilities) of
+    each hypothesis, second_round_series (candidates, day numbers, conditional
+    win probabilities) of the winning duo or None
+    """
     plt.style.use("seaborn-white")
     fig = plt.figure(figsize=(11,5))
     ax = fig.add_subplot(1, 1, 1)
     locale.setlocale(locale.LC_ALL, "fr_FR.UTF-8")
 
-    # Intervals where candidate hypothesis are to be plotted
-    segments_begins, time_election_models = list(zip(*dated_time_election_models))
-    segments_ends = list(segments_begins[1:]) + [election["date_second_round"] + datetime.timedelta(1)]
-
     # Dictionnary with key: candidate, value: (poll_dates, total_win_prob)
     candidates_data = defaultdict(lambda: ([], []))
 
-    # For each segment, keep polls they contain
-    for segment_begin, segment_end, time_election_model in zip(segments_begins, segments_ends, time_election_models):
-        # Take poll_dates and win_probs that are within the segment
-        for poll_date, election_model in zip(time_election_model.poll_dates, time_election_model.election_models):
-            if poll_date >= segment_begin and poll_date < segment_end:
-                win_prob = election_model.total_win_probability()
-                for candidate in election_model.candidates:
-                    candidates_data[candidate][0].append(poll_date)
-                    candidates_data[candidate][1].append(win_prob[candidate])
+    # Each hypothesis only has polls until the next one begins
+    for candidates, days, win_probs in first_round_series:
+        for poll_date, win_prob in zip(days_to_dates(days), win_probs):
+            for candidate, p in zip(candidates, win_prob):
+                candidates_data[candidate][0].append(poll_date)
+                candidates_data[candidate][1].append(p)
 
     # Build candidate order for plotting, from worse to best
     candidates_ordered = list(zip(*sorted({c: candidates_data[c][1][-1] for c in candidates_data.keys()}.items(), key=lambda x: x[1])))[0]
@@ -190,40 +199,33 @@ def time_plot(filename, election, dated_time_election_models, winning_duo, inter
                 label=candidate,
                 )
 
-    # Plot second round lines
-    if winning_duo is not None:
-        # poll dates in between rounds
-        time_election_model = time_election_models[-1] # take the last hypothesis, but conditional models are the same
-
-        poll_dates = pd.DatetimeIndex(time_election_model.poll_dates)
-
-        # If there's anything to plot
-        if poll_dates.max() > election["date_first_round"]:
+    # Plot second round lines, if there are polls in between rounds
+    if second_round_series is not None:
+        candidates, days, cond_win_probs = second_round_series
+        poll_dates = days_to_dates(days)
 
-            # Same as above
-            candidates_data_second_round = defaultdict(lambda: ([], []))
+        # Same as above
+        candidates_data_second_round = defaultdict(lambda: ([], []))
 
-            for poll_date, election_model in zip(time_election_model.poll_dates, time_election_model.election_models):
-                model = election_model.models_second_rounds[winning_duo]
-                cond_win_prob = model.probability_win()
-                for c, p in zip(model.candidates, cond_win_prob):
-                    candidates_data_second_round[c][0].append(poll_date)
-                    candidates_data_second_round[c][1].append(p)
+        for poll_date, cond_win_prob in zip(poll_dates, cond_win_probs):
+            for c, p in zip(candidates, cond_win_prob):
+                candidates_data_second_round[c][0].append(poll_date)
+                candidates_data_second_round[c][1].append(p)
 
-            # Plot
-            for candidate in candidates_data_second_round.keys(): # whatever order here
-                X = drange(election["date_first_round"], poll_dates.max()+datetime.timedelta(1), datetime.timedelta(1))
-                Y = candidates_data_second_round[candidate][1]
+        # Plot
+        for candidate in candidates_data_second_round.keys(): # whatever order here
+            X = drange(election["date_first_round"], poll_dates.max()+datetime.timedelta(1), datetime.timedelta(1))
+            Y = candidates_data_second_round[candidate][1]
 
-                interpolated = scipy.interpolate.interp1d(date2num(candidates_data_second_round[candidate][0]), Y, kind=interpolation)
+            interpolated = scipy.interpolate.interp1d(date2num(candidates_data_second_round[candidate][0]), Y, kind=interpolation)
 
-                ax.plot_date(X, interpolated(X),
-                        linestyle="-",
-                        marker="",
-                        linewidth=2.5,
-                        color=exdata.candidates_colors[candidate],
-                        label=candidate,
-                        )
+            ax.plot_date(X, interpolated(X),
+                    linestyle="-",
+                    marker="",
+                    linewidth=2.5,
+                    color=exdata.candidates_colors[candidate],
+                    label=candidate,
+                    )
 
     # Plot events
     for date, candidate, label, textypos, halign in events[str(election["date_first_round"].year)]:
@@ -313,7 +315,7 @@ def time_plot(filename, election, dated_time_election_models, winning_duo, inter
     #ax.text(date2num(start + datetime.timedelta(1)), 0.95 + 0.025, "depuis1958.fr", horizontalalignment="left", verticalalignment="center", size=small_text, color=background_gray)
     #ax.text(date2num(start + datetime.timedelta(1)), 0.90 + 0.025, "CC BY-NC 3.0 FR", horizontalalignment="left", verticalalignment="center", size=small_text, color=background_gray)
 
-    fig.savefig(filename, dpi=300, bbox_inches="tight")
+    fig.savefig(filename, dpi=300, bbox_inches="tight", format="png")
 
     plt.close(fig)
 
@@ -360,4 +362,4 @@ def pgm(path):
 
     # Render and save.
     pgm.render()
-    pgm.figure.savefig(path, dpi=300)
+    pgm.figure.savefig(path, dpi=300, format="png")
@@ -1,19 +1,472 @@
 import numpy as np
-import scipy.stats
-from collections import defaultdict
+import scipy.special
+from collections import OrderedDict
 import warnings
 import itertools
+import concurrent.futures
+
+from sampling import ScipySampler, scipy_stats
+
+class SampleCache(object):
+    """
+    Samples shared by all queries on a model, drawn once on first use
+    Least recently used samples are evicted to stay within budget (in bytes)
+    """
+    def __init__(self, budget):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.nbytes = 0
+
+    def get(self, model):
+        "Cached samples of model, drawing and storing them if needed"
+        if model in self.entries:
+            self.entries.move_to_end(model)
+            return self.entries[model]
+
+        samples = model.draw_samples()
+
+        # Too large to ever fit, don't evict everything else for nothing
+        if samples.nbytes > self.budget:
+            return samples
+
+        while self.nbytes + samples.nbytes > self.budget:
+            self.release(next(iter(self.entries)))
+
+        self.entries[model] = samples
+        self.nbytes += samples.nbytes
+        return samples
+
+    def release(self, model):
+        "Free memory used by model's samples, if any"
+        samples = self.entries.pop(model, None)
+        if samples is not None:
+            self.nbytes -= samples.nbytes
+
+    def clear(self):
+        "Free all cached samples"
+        self.entries.clear()
+        self.nbytes = 0
+
+# Shared by all models unless told otherwise, enough for the samples of the
+# main model (5,000,000 samples of 16 candidates take 640 MB)
+sample_cache = SampleCache(budget=1024**3)
+
+class RankStatistics(object):
+    """
+    Rank and first round duo counts, accumulated in a single pass over blocks of samples
+    Only the {depth} highest scores of each sample are ranked
+    With batch_error, the error is estimated from the spread between blocks
+    (batch means), needed when samples within a block are not independent
+    """
+    def __init__(self, size, depth=None, batch_error=False):
+        self.size = size
+        self.depth = size if depth is None else min(depth, size)
+        assert self.depth >= 2
+        self.batch_error = batch_error
+
+        # rank_counts[i, r]: number of samples where candidate i is ranked r (0-based)
+        self.rank_counts = np.zeros((self.size, self.depth), dtype=np.int64)
+
+        # duo_counts[i * size + j]: number of samples where i and j (i < j) are the two first
+        self.duo_counts = np.zeros(self.size * self.size, dtype=np.int64)
+
+        self.number_of_samples = 0
+
+        # Sums of all probabilities of each block, and of their squares
+        self.number_of_batches = 0
+        self.batch_sums = 0
+        self.batch_squares = 0
+
+    def top(self, samples):
+        "Indexes of the {depth} highest scores of each sample, highest first"
+        N, k = self.size, self.depth
+        if k < N:
+            # Partial selection of the top k (unordered), then sort only those
+            top = np.argpartition(samples, N - k, axis=1)[:, N - k:]
+            order = np.argsort(np.take_along_axis(samples, top, axis=1), axis=1)
+            top = np.take_along_axis(top, order, axis=1)
+        else:
+            top = np.argsort(samples, axis=1)
+        # Candidate indexes are small, keep them as small integer codes
+        return top[:, ::-1].astype(np.int16)
+
+    def add(self, samples):
+        "Accumulate counts of a block of samples"
+        N, k = self.size, self.depth
+        top = self.top(samples)
+
+        # Code (candidate, rank) pairs as candidate * depth + rank and count them all at once
+        codes = top * k + np.arange(k, dtype=np.int16)
+        rank_counts = np.bincount(codes.ravel(), minlength=N * k)
+        self.rank_counts += rank_counts.reshape((N, k))
+
+        # Unordered pairs of the two first, coded as lower * size + higher
+        first, second = top[:, 0], top[:, 1]
+        codes = np.minimum(first, second) * N + np.maximum(first, second)
+        duo_counts = np.bincount(codes, minlength=N * N)
+        self.duo_counts += duo_counts
+
+        self.number_of_samples += samples.shape[0]
+
+        batch = np.concatenate((rank_counts, duo_counts)) / samples.shape[0]
+        self.number_of_batches += 1
+        self.batch_sums = self.batch_sums + batch
+        self.batch_squares = self.batch_squares + batch * batch
+
+    def new(self):
+        "Empty statistics of the same kind"
+        return RankStatistics(self.size, self.depth, self.batch_error)
+
+    def merge(self, other):
+        "Add counts accumulated elsewhere (e.g. by another process)"
+        self.rank_counts += other.rank_counts
+        self.duo_counts += other.duo_counts
+        self.number_of_samples += other.number_of_samples
+        self.number_of_batches += other.number_of_batches
+        self.batch_sums = self.batch_sums + other.batch_sums
+        self.batch_squares = self.batch_squares + other.batch_squares
+
+    def standard_error(self):
+        "Largest Monte Carlo standard error of all rank and duo probabilities"
+        if self.batch_error:
+            # Variance of block probabilities, unknown with a single block
+            R = self.number_of_batches
+            if R < 2:
+                return np.inf
+            means = self.batch_sums / R
+            variances = (self.batch_squares / R - means * means) * R / (R - 1)
+            return np.sqrt(max(np.max(variances), 0) / R)
+
+        p = np.concatenate((self.rank_counts.ravel(), self.duo_counts)) / self.number_of_samples
+        return np.sqrt(np.max(p * (1 - p)) / self.number_of_samples)
+
+    def probability_rank(self, rank):
+        "Probability vector of being ranked {rank} (0-based)"
+        if rank >= self.depth:
+            raise ValueError("Rank {} is deeper than the {} ranks computed".format(rank, self.depth))
+        return self.rank_counts[:, rank] / self.number_of_samples
+
+    def probability_duos(self):
+        "Probability matrix of duos, upper triangular: [i, j] with i < j"
+        return self.duo_counts.reshape((self.size, self.size)) / self.number_of_samples
+
+class QuadratureStatistics(object):
+    """
+    Rank and first round duo probabilities by numerical integration, without sampling
+    With X_i independent Gamma(a_i, 1), X / sum(X) is Dirichlet(a) and has the
+    same ranks as X. So each probability is a one dimensional integral over the
+    score x of a single candidate c:
+        P(c ranked r) = integral of f_c(x) P(exactly r others > x) dx
+        P(i first, c second) = integral of f_c(x) (1 - F_i(x)) prod_{k != i, c} F_k(x) dx
+    Integrals use composite Gauss-Legendre, doubling the number of panels until
+    successive results differ by less than tolerance
+    """
+    nodes, node_weights = np.polynomial.legendre.leggauss(16)
+    max_panels = 2**12
+
+    def __init__(self, weights, depth=None, tolerance=1e-6):
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.size = len(self.weights)
+        self.depth = self.size if depth is None else min(depth, self.size)
+        self.tolerance = tolerance
+
+        # rank_probabilities[i, r]: probability that i is ranked r (0-based)
+        # ordered_duos[i, j]: probability that i is first and j second
+        self.rank_probabilities = np.zeros((self.size, self.depth))
+        self.ordered_duos = np.zeros((self.size, self.size))
+
+        # Largest difference between the last two refinements, over all integrals
+        self.error = 0
+
+        for c in range(self.size):
+            self.integrate(c)
+
+    def integrands(self, c, x):
+        "Integrands of all probabilities computed with the density of c, at points x"
+        a = self.weights[:, np.newaxis]
+        F = scipy.special.gammainc(a, x)
+        S = scipy.special.gammaincc(a, x)
+        f = np.exp(scipy.special.xlogy(self.weights[c] - 1, x) - x - scipy.special.gammaln(self.weights[c]))
+        others = [k for k in range(self.size) if k != c]
+
+        # Poisson binomial distribution of the number of others above x, truncated to depth
+        poly = np.zeros((self.depth, len(x)))
+        poly[0] = 1
+        for k in others:
+            above = poly[:-1] * S[k]
+            poly *= F[k]
+            poly[1:] += above
+
+        # Products of F over others but one, from prefix and suffix products
+        prefix = np.ones((self.size, len(x)))
+        prefix[1:] = np.cumprod(F[others], axis=0)
+        suffix = np.ones((self.size, len(x)))
+        suffix[:-1] = np.cumprod(F[others][::-1], axis=0)[::-1]
+        leave_one_out = prefix[:-1] * suffix[1:]
+
+        return poly * f, S[others] * leave_one_out * f
+
+    def quadrature(self, c, lower, upper, panels):
+        "Integrals of the integrands of c over [lower, upper] with a number of panels"
+        edges = np.linspace(lower, upper, panels + 1)
+        halves = (edges[1:] - edges[:-1])[:, np.newaxis] / 2
+        middles = (edges[1:] + edges[:-1])[:, np.newaxis] / 2
+        x = (middles + halves * self.nodes).ravel()
+        w = (halves * self.node_weights).ravel()
+        ranks, duos = self.integrands(c, x)
+        return ranks @ w, duos @ w
+
+    def integrate(self, c):
+        # Bounds of the score of c, leaving out a negligible mass
+        mass = self.tolerance * 1e-3
+        lower = scipy.special.gammaincinv(self.weights[c], mass)
+        upper = scipy.special.gammainccinv(self.weights[c], mass)
+
+        panels = 4
+        ranks, duos = self.quadrature(c, lower, upper, panels)
+        while True:
+            panels *= 2
+            refined_ranks, refined_duos = self.quadrature(c, lower, upper, panels)
+            error = max(np.max(np.abs(refined_ranks - ranks)), np.max(np.abs(refined_duos - duos), initial=0))
+            ranks, duos = refined_ranks, refined_duos
+            if error <= self.tolerance or panels >= self.max_panels:
+                break
+
+        if error > self.tolerance:
+            warnings.warn("Quadrature did not reach tolerance {} (error {})".format(self.tolerance, error))
+        self.error = max(self.error, error)
+
+        others = [k for k in range(self.size) if k != c]
+        self.rank_probabilities[c] = ranks
+        self.ordered_duos[others, c] = duos
+
+    def standard_error(self):
+        "Estimated integration error"
+        return self.error
+
+    def probability_rank(self, rank):
+        "Probability vector of being ranked {rank} (0-based)"
+        if rank >= self.depth:
+            raise ValueError("Rank {} is deeper than the {} ranks computed".format(rank, self.depth))
+        return self.rank_probabilities[:, rank]
+
+    def probability_duos(self):
+        "Probability matrix of duos, upper triangular: [i, j] with i < j"
+        return np.triu(self.ordered_duos + self.ordered_duos.T, 1)
+
+class ExceedanceCounts(object):
+    "Number of samples where each score is greater than a reference"
+    def __init__(self, reference):
+        self.reference = reference
+        self.counts = 0
+        self.number_of_samples = 0
+
+    def add(self, samples):
+        self.counts = self.counts + np.sum(samples > self.reference, axis=0)
+        self.number_of_samples += samples.shape[0]
+
+    def new(self):
+        return ExceedanceCounts(self.reference)
+
+    def merge(self, other):
+        self.counts = self.counts + other.counts
+        self.number_of_samples += other.number_of_samples
+
+    def standard_error(self):
+        p = self.probability()
+        return np.sqrt(np.max(p * (1 - p)) / self.number_of_samples)
+
+    def probability(self):
+        return self.counts / self.number_of_samples
+
+def accumulate_samples(sampler, weights, number_of_samples, block_size, statistics):
+    "Draw samples block by block and add them to statistics, also run in worker processes"
+    for begin in range(0, number_of_samples, block_size):
+        statistics.add(sampler.draw(weights, min(block_size, number_of_samples - begin), reuse_buffer=True))
+    return statistics
+
+class SampleBudget(object):
+    """
+    Total number of samples shared by the rank statistics of several models,
+    e.g. all dates of a time plot
+    Samples are allocated once for all models, when the first one is queried,
+    in rounds: every model gets a first batch, then each round gives one more
+    batch to the models still above their target error, until the budget is
+    spent. So the samples left by easy models go to the close ones, whatever
+    their order. First batches are smaller when the budget can't cover a full
+    one for each model, so that the total is never exceeded
+    """
+    def __init__(self, total):
+        self.remaining = total
+        self.models = []
+
+    def add(self, model):
+        "Share the budget with a model in adaptive mode"
+        self.models.append(model)
+
+    def allocate(self):
+        "Rank statistics of all models, sampled in rounds"
+        statistics = [model.new_rank_statistics() for model in self.models]
+
+        # Every model gets a first batch, so that it has an estimate
+        first_batch = self.remaining // len(self.models)
+        if first_batch == 0:
+            raise ValueError("A sample budget of {} can't give a sample to each of {} models".format(self.remaining, len(self.models)))
+        if any(first_batch < model.adaptive_batch(s) for model, s in zip(self.models, statistics)):
+            warnings.warn("A sample budget of {} only gives first batches of {} samples to each of {} models".format(
+                self.remaining, first_batch, len(self.models)))
+
+        active = list(range(len(self.models)))
+        first_round = True
+        while active:
+            still_active = []
+            for k in active:
+                model = self.models[k]
+                number_of_samples = model.adaptive_batch(statistics[k])
+                if first_round:
+                    number_of_samples = min(number_of_samples, first_batch)
+                else:
+                    number_of_samples = min(number_of_samples, max(self.remaining, 0))
+                if number_of_samples == 0:
+                    continue
+                self.remaining -= number_of_samples
+
+                model.accumulate_batch(statistics[k], number_of_samples)
+                if statistics[k].standard_error() > model.target_error:
+                    still_active.append(k)
+            active = still_active
+            first_round = False
+
+        for model, model_statistics in zip(self.models, statistics):
+            model._rank_statistics = model_statistics
+
+# Samples drawn at a time in adaptive mode, unless block_size is set
+adaptive_batch_size = 100000
+
+# Process pools by number of workers, e.g. one for sampling models and one for time plots
+_pools = {}
+
+def process_pool(workers):
+    "Process pool of a number of workers shared by all models, created on first use"
+    if workers not in _pools:
+        _pools[workers] = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    return _pools[workers]
 
 class DirichletModel(object):
-    def __init__(self, candidates, concentration_parameters, number_of_samples):
+    def __init__(self, candidates, concentration_parameters, number_of_samples,
+                 sampler=None, cache=None, block_size=None, rank_depth=None, workers=1,
+                 target_error=None, budget=None, tolerance=None):
         self.candidates = candidates
         self.weights = concentration_parameters
         self.size = len(self.weights)
         self.number_of_samples = number_of_samples
+        self.sampler = ScipySampler() if sampler is None else sampler
+        self.cache = sample_cache if cache is None else cache
+
+        # Streaming mode: samples are drawn block_size at a time and never all
+        # kept in memory, queries keep running counts across blocks
+        # Variance reduced samplers are always streamed, one replicate per block
+        if block_size is None:
+            block_size = self.sampler.replicate_size
+        self.block_size = block_size
+
+        # Number of ranks computed for rank queries, None for all of them
+        self.rank_depth = rank_depth
+        self._rank_statistics = None
+
+        # Parallel mode: samples are split across worker processes, each with
+        # its own random stream, and only counts are sent back
+        self.workers = workers
+
+        # Adaptive mode: samples are drawn in batches until all probabilities have
+        # a standard error below target_error, number_of_samples is then an upper
+        # bound, and so is the optional SampleBudget shared with other models
+        self.target_error = target_error
+        self.budget = budget
+        if budget is not None and target_error is not None and tolerance is None:
+            budget.add(self)
+
+        # Quadrature mode: probabilities are integrated numerically to this
+        # tolerance, nothing is sampled
+        self.tolerance = tolerance
+
+    def draw_samples(self, number_of_samples=None, reuse_buffer=False):
+        """
+        Generate new samples from the distribution
+        With reuse_buffer, they may be overwritten by the next draw
+        """
+        if number_of_samples is None:
+            number_of_samples = self.number_of_samples
+        return self.sampler.draw(self.weights, number_of_samples, reuse_buffer)
 
     def get_samples(self):
-        """Generate samples from the distribution"""
-        return scipy.stats.dirichlet.rvs(self.weights, size=self.number_of_samples)
+        """Samples from the distribution, drawn once and shared by all queries"""
+        return self.cache.get(self)
+
+    def release_samples(self):
+        """Free memory used by the samples, they will be drawn again if needed"""
+        self.cache.release(self)
+
+    def sample_blocks(self):
+        """
+        Iterate over the samples, all at once from the cache or in fresh blocks
+        of block_size in streaming mode
+        """
+        if self.block_size is None:
+            yield self.get_samples()
+        else:
+            for begin in range(0, self.number_of_samples, self.block_size):
+                yield self.draw_samples(min(self.block_size, self.number_of_samples - begin), reuse_buffer=True)
+
+    def accumulate(self, statistics):
+        """
+        Add all samples to statistics (counts with add(), merge() and standard_error() methods)
+        In parallel mode, results only depend on the sampler seed and the number of workers
+        """
+        if self.target_error is not None:
+            return self.accumulate_adaptive(statistics)
+
+        if self.workers <= 1:
+            for samples in self.sample_blocks():
+                statistics.add(samples)
+            return statistics
+
+        return self.accumulate_parallel(statistics, self.number_of_samples)
+
+    def accumulate_parallel(self, statistics, number_of_samples):
+        "Add number_of_samples new samples to statistics, drawn by worker processes"
+        # Split samples evenly, each worker drawing from its own spawned stream
+        sizes = [len(chunk) for chunk in np.array_split(np.arange(number_of_samples), self.workers)]
+        samplers = self.sampler.spawn(self.workers)
+        pool = process_pool(self.workers)
+        futures = [pool.submit(accumulate_samples, sampler, self.weights, size, self.block_size or max(size, 1), statistics.new())
+                   for sampler, size in zip(samplers, sizes)]
+
+        # Reduce in submission order
+        for future in futures:
+            statistics.merge(future.result())
+        return statistics
+
+    def adaptive_batch(self, statistics):
+        "Number of samples of the next batch in adaptive mode, 0 once all are drawn"
+        batch_size = self.block_size or adaptive_batch_size
+        return min(batch_size * max(self.workers, 1), self.number_of_samples - statistics.number_of_samples)
+
+    def accumulate_batch(self, statistics, number_of_samples):
+        "Add a batch of number_of_samples new samples to statistics"
+        if self.workers <= 1:
+            accumulate_samples(self.sampler, self.weights, number_of_samples, self.block_size or adaptive_batch_size, statistics)
+        else:
+            self.accumulate_parallel(statistics, number_of_samples)
+
+    def accumulate_adaptive(self, statistics):
+        "Add batches of new samples to statistics until precise enough or out of samples"
+        while statistics.number_of_samples < self.number_of_samples:
+            self.accumulate_batch(statistics, self.adaptive_batch(statistics))
+            if statistics.standard_error() <= self.target_error:
+                break
+
+        return statistics
 
     def sum(self):
         "Sum of the concentration parameters"
@@ -45,59 +498,60 @@ class DirichletModel(object):
     def probability_win(self):
         "Probability vector of individual score > 0.5"
         alphas, betas = self.marginal_parameters()
-        return np.array([1 - scipy.stats.beta.cdf(0.5, a, b) for a, b in zip(alphas, betas)])
+        # P(Beta(a, b) > 0.5) = I_0.5(b, a)
+        return scipy.special.betainc(betas, alphas, 0.5)
+
+    def rank_statistics(self):
+        "Rank and duo counts of all samples, computed once and shared by all rank queries"
+        if self._rank_statistics is None:
+            if self.tolerance is not None:
+                self._rank_statistics = QuadratureStatistics(self.weights, self.rank_depth, self.tolerance)
+            elif self.budget is not None and self.target_error is not None:
+                # Sets the statistics of all models sharing the budget
+                self.budget.allocate()
+            else:
+                self._rank_statistics = self.accumulate(self.new_rank_statistics())
+        return self._rank_statistics
 
-    def samples_ranks(self):
-        "argsort in reverse order (highest score first), then argsort again to get ranks"
-        samples = self.get_samples()
-        sort_indices = np.fliplr(np.argsort(samples, axis=1))
-        return np.argsort(sort_indices)
+    def new_rank_statistics(self):
+        "Empty rank statistics for the samples of this model"
+        batch_error = self.sampler.replicate_size is not None
+        return RankStatistics(self.size, self.rank_depth, batch_error)
+
+    def standard_error(self):
+        "Estimated standard error of the rank and duo probabilities (integration error in quadrature mode)"
+        return self.rank_statistics().standard_error()
 
     def probability_rank(self, rank):
         """
         Probability of being {rank}
         rank is a 0-based index
         """
-        ranks = self.samples_ranks()
-
-        return np.sum(ranks[:, :] == rank, axis=0) / self.number_of_samples
+        return self.rank_statistics().probability_rank(rank)
 
     def probability_second_round(self):
         "Probability vector of individually passing to second round"
-
-        ranks = self.samples_ranks()
+        statistics = self.rank_statistics()
 
         # Probability of being first or second
-        first = np.sum(ranks[:, :] == 0, axis=0) / self.number_of_samples
-        second = np.sum(ranks[:, :] == 1, axis=0) / self.number_of_samples
-        return first + second
+        return statistics.probability_rank(0) + statistics.probability_rank(1)
 
     def probability_better_than(self, R):
         "Individual probabilities of being greater than a reference"
-        samples = self.get_samples()
-        return np.sum(samples > R, axis=0) / self.number_of_samples
+        if self.tolerance is not None:
+            # Marginals are beta distributed
+            alphas, betas = self.marginal_parameters()
+            return scipy_stats().beta.sf(R, alphas, betas)
+        return self.accumulate(ExceedanceCounts(R)).probability()
 
     def probability_duos(self):
         "Probability of second round duos"
-        # Indexes of the two winners
-        samples = self.get_samples()
-        winners = np.fliplr(np.argsort(samples, axis=1))[:, :2]
-
-        # Frequency count of rows of 'winners'
-        # crazy snippet from http://stackoverflow.com/a/16973510/565840
-        b = np.ascontiguousarray(winners).view(np.dtype((np.void, winners.dtype.itemsize * winners.shape[1])))
-        _, idx, pcounts = np.unique(b, return_index=True, return_counts=True)
-
-        # First round results are unordered pairs, so sum equivalent ones using a frozenset dict key
-        counts = defaultdict(int)
-        for pair, pc in zip(winners[idx], pcounts):
-            key = frozenset({self.candidates[pair[0]], self.candidates[pair[1]]})
-            counts[key] += pc
-
-        # Divide by number of samples to get probability, zero if unseen
+        duos = self.rank_statistics().probability_duos()
+
+        # First round results are unordered pairs, stored in the upper triangle
         probs = {
-            duo: counts[duo] / self.number_of_samples
-            for duo in all_possible_second_rounds(self.candidates)
+            frozenset({self.candidates[i], self.candidates[j]}): duos[i, j]
+            for i, j in itertools.combinations(range(self.size), 2)
         }
 
         # TODO this does not take into account that the second round might not
@@ -106,25 +560,43 @@ class DirichletModel(object):
 
     def covariance_matrix(self):
         "Covariance matrix"
-        cov = np.zeros((self.size, self.size))
-
         a0 = np.sum(self.weights)
         D = a0*a0*(a0+1)
 
-        # Diagonal
-        for k in range(self.size):
-            ak = self.weights[k]
-            cov[k, k] = (ak*(a0-ak))/D
+        # Off diagonal -ai*aj, diagonal ak*(a0-ak)
+        cov = -np.outer(self.weights, self.weights)
+        cov[np.diag_indices(self.size)] = self.weights * (a0 - self.weights)
+        return cov / D
+
+# Number of values drawn at a time by batch_duo_probabilities, unless block_size is set
+batch_block_elements = 2**24
+
+def batch_duo_probabilities(weights, number_of_samples, sampler, block_size=None, tolerance=None):
+    """
+    First round duo probabilities of many models at once, given one row of
+    concentration parameters per model (e.g. one per date of a time plot)
+    Returns upper triangular matrices [model, i, j] with i < j
+    With tolerance, probabilities are integrated numerically instead
+    """
+    M, N = weights.shape
+    if tolerance is not None:
+        return np.array([QuadratureStatistics(w, 2, tolerance).probability_duos() for w in weights])
+
+    if block_size is None:
+        block_size = max(1, batch_block_elements // (M * N))
+
+    # Duo of model m coded as m * N * N + lower * N + higher, all counted at once
+    offsets = (np.arange(M) * N * N)[:, np.newaxis]
+    counts = np.zeros(M * N * N, dtype=np.int64)
+    for begin in range(0, number_of_samples, block_size):
+        gammas = sampler.gamma_batch(weights, min(block_size, number_of_samples - begin))
 
-        # Off diagonal
-        for i in range(self.size):
-            for j in range(self.size):
-                if i != j:
-                    ai = self.weights[i]
-                    aj = self.weights[j]
-                    cov[i, j] = (-ai*aj)/D
+        # Two highest of each sample, unordered
+        top = np.argpartition(gammas, N - 2, axis=2)[:, :, N - 2:]
+        codes = offsets + np.min(top, axis=2) * N + np.max(top, axis=2)
+        counts += np.bincount(codes.ravel(), minlength=M * N * N)
 
-        return cov
+    return counts.reshape((M, N, N)) / number_of_samples
 
 def all_possible_second_rounds(candidates):
     s = frozenset({frozenset({i, j}) for i, j in itertools.product(candidates, candidates) if i != j})
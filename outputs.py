@@ -0,0 +1,161 @@
+import os
+from os.path import join
+import hashlib
+import json
+import io
+import glob
+import pickle
+
+import numpy as np
+
+# Modules whose code makes the outputs, an output is made again when they change
+# Model results don't depend on how they are shown (page.py, graphs.py), and
+# settings values are part of their inputs
+results_modules = ["exdata.py", "model.py", "sampling.py", "polls.py", "election.py"]
+code_modules = results_modules + ["settings.py", "page.py", "graphs.py"]
+
+_code_versions = {}
+
+def code_version(modules=code_modules):
+    "Hash of the sources of modules"
+    modules = tuple(modules)
+    if modules not in _code_versions:
+        directory = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha256()
+        for module in modules:
+            with open(join(directory, module), "rb") as f:
+                digest.update(f.read())
+        _code_versions[modules] = digest.hexdigest()
+    return _code_versions[modules]
+
+def update_digest(digest, value):
+    if isinstance(value, np.ndarray):
+        digest.update(repr((value.dtype.str, value.shape)).encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        # Same hash whatever the insertion order
+        digest.update(b"dict")
+        for key in sorted(value, key=repr):
+            update_digest(digest, key)
+            update_digest(digest, value[key])
+    elif isinstance(value, (list, tuple)):
+        digest.update(repr((type(value).__name__, len(value))).encode())
+        for item in value:
+            update_digest(digest, item)
+    else:
+        digest.update(repr(value).encode())
+        digest.update(b"\0")
+
+def input_hash(*inputs, modules=code_modules):
+    """
+    Hash of the inputs of an output and of the code version of modules
+    Inputs are arrays, dicts, lists, tuples and values with a deterministic repr
+    """
+    digest = hashlib.sha256(code_version(modules).encode())
+    for value in inputs:
+        update_digest(digest, value)
+    return digest.hexdigest()
+
+def write_if_changed(path, data):
+    """
+    Write bytes to a file unless it already has them, so that its modification
+    time only changes with its content. Returns whether the file was written
+    """
+    try:
+        with open(path, "rb") as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+
+    # Written to a temporary file first, so that readers never see a partial file
+    temporary_file = "{}.{}.tmp".format(path, os.getpid())
+    with open(temporary_file, "wb") as f:
+        f.write(data)
+    os.replace(temporary_file, path)
+    return True
+
+class Manifest(object):
+    """
+    Input hash of each output file of the last builds, by path
+    Only the build process updates and writes it, jobs only make the files
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        try:
+            with open(filename) as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.entries = {}
+
+    def up_to_date(self, path, key):
+        return self.entries.get(path) == key and os.path.isfile(path)
+
+    def update(self, entries):
+        self.entries.update(entries)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        write_if_changed(self.filename, json.dumps(self.entries, indent=1, sort_keys=True).encode())
+
+def render_image(path, plot, *args):
+    "Image drawn by plot(file, *args), only written if its content changed"
+    buffer = io.BytesIO()
+    plot(buffer, *args)
+    write_if_changed(path, buffer.getvalue())
+
+def render_images(images, manifest, executor=None):
+    """
+    Render images given as (path, input hash, plot, args) that are not up to
+    date in manifest, as jobs on executor (e.g. a process pool) or one after
+    another in this process without executor. Returns their manifest entries
+    """
+    futures = []
+    for path, key, plot, args in images:
+        if manifest.up_to_date(path, key):
+            continue
+        if executor is None:
+            render_image(path, plot, *args)
+        else:
+            futures.append(executor.submit(render_image, path, plot, *args))
+
+    for future in futures:
+        future.result()
+    return {path: key for path, key, plot, args in images}
+
+class ResultsStore(object):
+    """
+    Results kept on disk between builds, by name and hash of their inputs (see input_hash)
+    Only the results of the latest inputs of each name are kept
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def filename(self, name, key):
+        return join(self.directory, "{}-{}.pickle".format(name, key))
+
+    def get(self, name, key):
+        "Results stored with these inputs, None if there are none"
+        filename = self.filename(name, key)
+        try:
+            with open(filename, "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            # Truncated file, or pickled by other code: computed again
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            return None
+
+    def put(self, name, key, results):
+        os.makedirs(self.directory, exist_ok=True)
+        filename = self.filename(name, key)
+        write_if_changed(filename, pickle.dumps(results, protocol=pickle.HIGHEST_PROTOCOL))
+
+        # Results of previous inputs are not used anymore
+        for path in glob.glob(self.filename(glob.escape(name), "*")):
+            if path != filename:
+                os.remove(path)
@@ -4,28 +4,33 @@
 import os
 from os.path import join
 import datetime
-import shutil
+import glob
 import locale
 import argparse
 import subprocess
 import sys
+import time
+import traceback
+import concurrent.futures
 
 import numpy as np
-import pandas as pd
 
 from jinja2 import Environment, FileSystemLoader
 
-from model import sortby, all_possible_second_rounds
+from model import sortby
 from graphs import violin_vert, pgm, time_plot
 import exdata
-from polls import PollCollection, second_round_poll_file
-from election import ElectionModel, TimeElectionModel
+from polls import DataCatalog
+from election import second_round_models, duo_probabilities_memo, model_results, time_series
+from settings import default_settings, check_settings
+from tasks import TaskGraph
+from outputs import input_hash, write_if_changed, render_image, render_images, Manifest, ResultsStore, results_modules
 
 def percent(x):
     "HTML rendering of a percentage value"
     return "{0:.1f}&nbsp;%".format(100*x)
 
-def context_total(election_model, settings):
+def context_total(total_win_probability, settings):
     # Total probabilities
     context = []
 
@@ -34,30 +39,27 @@ def context_total(election_model, settings):
         # Use minus here, not reverse=True because alphabetical is correct order already
         return (-x[1], exdata.candidates_alphabetical_index[x[0]])
 
-    for i, (c, v) in enumerate(sorted(election_model.total_win_probability().items(), key=key)):
+    for i, (c, v) in enumerate(sorted(total_win_probability.items(), key=key)):
         context.append((c, percent(v)))
 
     return context
 
-def context_duos(model, second_rounds, settings):
+def context_duos(duos, settings):
     context = []
 
     def key(x):
         "Sort by (inverse) duo probability, then alphabetical if equal"
         # Use minus here, not reverse=True because alphabetical is correct order already
-        duo, prob = x
+        duo, result = x
+        prob = result[0]
         c1, c2 = list(duo)
         return (-prob,
                 min(exdata.candidates_alphabetical_index[c1], exdata.candidates_alphabetical_index[c2]),
                 max(exdata.candidates_alphabetical_index[c1], exdata.candidates_alphabetical_index[c2]))
 
     # Probability duos from most to least probable
-    for i, (duo, prob_duo) in enumerate(sorted(model.probability_duos().items(), key=key)):
-        candidates = second_rounds[duo].candidates
-        probs = second_rounds[duo].probability_win()
-
-
-        if second_rounds[duo].sum() > 2:
+    for i, (duo, (prob_duo, candidates, probs, polled)) in enumerate(sorted(duos.items(), key=key)):
+        if polled:
             # Sort by conditional winner
             indexes = np.argsort(probs)[::-1]
         else:
@@ -71,202 +73,390 @@ def context_duos(model, second_rounds, settings):
         klass = "hiddable" if i+1 > settings["show_n_duos"] else ""
 
         # Render "-" if no conditional poll, not "50 %"
-        rendered_prob_c1 = percent(prob_c1) if second_rounds[duo].sum() > 2 else "-"
-        rendered_prob_c2 = percent(prob_c2) if second_rounds[duo].sum() > 2 else "-"
+        rendered_prob_c1 = percent(prob_c1) if polled else "-"
+        rendered_prob_c2 = percent(prob_c2) if polled else "-"
 
         context.append([percent(prob_duo), c1, c2, rendered_prob_c1, rendered_prob_c2, klass])
     return context
 
-def equivalent_score_2012(candidates, results_2012):
-    "Vector of scores in 2012 election (thyself or party equivalent)"
-    scores = np.zeros(len(candidates))
-    for i, c in enumerate(candidates):
-        if c in results_2012.keys():
-            scores[i] = results_2012[c] / 100
-        elif c in exdata.candidates_2012_equivalents.keys():
-            scores[i] = results_2012[exdata.candidates_2012_equivalents[c]] / 100
-    return scores
-
-def context_individuals(model, settings):
-    # Probabilities of second round
-    probs_second_round = model.probability_second_round()
-    probs_third = model.probability_rank(2) # rank is 0-based here
-
+def context_individuals(individuals, settings):
+    candidates = individuals["candidates"]
+    probs_second_round = individuals["second_round"]
+    probs_third = individuals["third"]
+    probs_better_last = individuals["better_than_2012"]
     results_2012 = exdata.elections["2012"]["official_results"]
-    ref = equivalent_score_2012(model.candidates, results_2012)
-    probs_better_last = model.probability_better_than(ref)
 
     # Sort by inverse second round prob, then alphabetical
     # yes this is black magic
-    indices = sorted(range(len(probs_second_round)), key=lambda x: (-probs_second_round[x], exdata.candidates_alphabetical_index[model.candidates[x]]))
+    indices = sorted(range(len(probs_second_round)), key=lambda x: (-probs_second_round[x], exdata.candidates_alphabetical_index[candidates[x]]))
 
     return [(c, percent(p1), percent(p2), percent(p3) if c in dict(results_2012, **exdata.candidates_2012_equivalents) else "-")
-            for c, p1, p2, p3 in zip(np.array(model.candidates)[indices],
+            for c, p1, p2, p3 in zip(np.array(candidates)[indices],
                                      probs_second_round[indices],
                                      probs_third[indices],
                                      probs_better_last[indices])]
 
-def context_source(election):
-    # set() to get unique sources
-    sources = set()
-    for date, first_round_filename in election["first_round_filenames"]:
-        first = pd.read_csv(first_round_filename)
-        for s in first.loc[:, "source"]:
-            sources.add(str(s))
-
-        candidates = first.columns[5:]
-
-    for duo in all_possible_second_rounds(candidates):
-        second_file = second_round_poll_file(election["second_round_prefix"], duo)
-        if os.path.isfile(second_file):
-            for s in pd.read_csv(second_file).loc[:, "source"]:
-                sources.add(str(s))
-
+def context_source(catalog):
     # sorted() so the html output is deterministic
-    return "&nbsp;• ".join(sorted(list(sources)))
+    return "&nbsp;• ".join(sorted(list(catalog.sources())))
 
-def context_polls(year):
-    root = "data/{}/".format(year)
-    names = sorted(os.listdir(root))
-    return [(name, join(root, name)) for name in names]
+def context_polls(catalog):
+    return catalog.listing()
 
 def trace(s):
     print(s)
     sys.stdout.flush()
 
-def context_full(election, settings, quick):
+# Input hashes of images and pages of previous builds, outputs with the same inputs are not made again
+manifest_filename = join("cache", "manifest.json")
+
+# Model results of previous builds, e.g. of past elections whose polls never change
+results_store = ResultsStore(join("cache", "results"))
+
+def violin_images(violins):
+    """
+    Images of violin plots given as (path, candidates, marginal parameters, means, ground truth),
+    see render_images
+    """
+    return [(path, input_hash(candidates, marginal_parameters, means, ground_truth),
+             violin_vert, (candidates, marginal_parameters, means, None, ground_truth))
+            for path, candidates, marginal_parameters, means, ground_truth in violins]
+
+def pgm_image():
+    "Image of the model diagram, see render_images"
+    return (join("public", "pgm.png"), input_hash("pgm"), pgm, ())
+
+# Settings only changing how jobs are scheduled, not their results
+scheduling_settings = ["time_workers", "build_workers"]
+
+# Settings only changing how pages show results, pages are always rendered again
+rendering_settings = ["show_n_duos"]
+
+def output_settings(settings):
+    "Settings that stored results and images depend on"
+    return {key: value for key, value in settings.items() if key not in scheduling_settings + rendering_settings}
+
+def context_models(election, settings, catalog):
+    """
+    Context of the main election model, without images
+    Returns the context and the violin plots to render, see violin_images
+    Model results are stored, and only computed again when the poll files,
+    settings or code change
+    """
     trace("{}...".format(election["date_first_round"].year))
 
+    # Date of the data rather than of the build, so that pages only change with their content
+    last_update = catalog.last_modified()
+    if last_update is None:
+        last_update = datetime.datetime.today()
     context = {
         "election": election,
         "settings": settings,
-        "last_update": datetime.datetime.today().strftime("%d/%m/%Y à %H:%M")
+        "last_update": last_update.strftime("%d/%m/%Y à %H:%M")
     }
     year = election["date_first_round"].year
 
-    trace("Building main election model with latest hypothesis...")
-    first_round_filename = election["first_round_filenames"][-1][1]
-    poll_collection = PollCollection(election, first_round_filename)
-    election_model = ElectionModel(election, poll_collection, election["date_second_round"], settings["number_of_samples_base"], settings)
+    key = input_hash(catalog.files_hash(), election, output_settings(settings), modules=results_modules)
+    results = results_store.get("{}-models".format(year), key)
+    if results is None:
+        trace("Building main election model with latest hypothesis...")
+        results = model_results(election, settings, catalog)
+        results_store.put("{}-models".format(year), key, results)
 
-    context["number_of_valid_polls"] = election_model.poll_collection.number_of_first_round_polls() + election_model.poll_collection.number_of_second_round_polls()
+    context["number_of_valid_polls"] = results["number_of_valid_polls"]
 
     # Number of samples formatted with space thousands separator
     locale.setlocale(locale.LC_ALL, "fr_FR.UTF-8")
     context["formatted_number_of_samples"] = locale.format("%d", settings["number_of_samples_base"], grouping=True)
 
-    # Violin plots
-    trace("Violin plots...")
-    filename_violin = "violin-" + repr(year) + ".png"
-    context["violin_path"] = filename_violin
-    #title = "Premier tour {} - Densités marginales aposteriori".format(year)
-    violin_vert(election_model.model_first_round, join("public", filename_violin), title=None, ground_truth=election["official_results"])
-
-    # Conditional violin plots
-    for duo, conditional_model in election_model.models_second_rounds.items():
-        filename_violin = "violin-" + repr(year) + repr(conditional_model.candidates) + ".png"
-        gs = None
-        if election["official_results_second_round"] and duo == frozenset(election["official_results_second_round"].keys()):
-            gs = election["official_results_second_round"]
-        if conditional_model.sum() > 2:
-            violin_vert(conditional_model, join("public", "violins", filename_violin), title=None, ground_truth=gs)
-
-    # Time plot
-    trace("Time election models...")
-    dated_time_election_models = [
-        (date, TimeElectionModel(election, PollCollection(election, first_round_filename), settings, quick))
-        for date, first_round_filename in election["first_round_filenames"]]
-    filename_time_plot = "time-plot-" + repr(year) + "-" + datetime.datetime.now().isoformat() + ".png"
-    context["time_plot_path"] = filename_time_plot
-    winning_duo = None
-    if election["official_results_second_round"] is not None:
-        winning_duo = frozenset(election["official_results_second_round"].keys())
-    trace("Time plot...")
-    time_plot(join("public", filename_time_plot), election, dated_time_election_models, winning_duo, interpolation="linear")
-
-    # PGM
-    pgm(join("public", "pgm.png"))
-
+    context["violin_path"] = "violin-" + repr(year) + ".png"
     context["prediction"] = {
-        "probability_total": context_total(election_model, settings),
-        "duos": context_duos(election_model.model_first_round, election_model.models_second_rounds, settings),
-        "individuals": context_individuals(election_model.model_first_round, settings),
+        "probability_total": context_total(results["total_win_probability"], settings),
+        "duos": context_duos(results["duos"], settings),
+        "individuals": context_individuals(results["individuals"], settings),
     }
 
-    context["data_source"] = context_source(election)
+    context["data_source"] = context_source(catalog)
 
-    context["list_of_polls"] = context_polls(election["date_first_round"].year)
+    context["list_of_polls"] = context_polls(catalog)
+
+    violins = [(join("public", context["violin_path"]),) + results["first_round_violin"]]
+    #title = "Premier tour {} - Densités marginales aposteriori".format(year)
+    for violin in results["second_round_violins"]:
+        candidates = violin[0]
+        violins.append((join("public", "violins", "violin-" + repr(year) + repr(candidates) + ".png"),) + violin)
+
+    return context, violins
+
+def time_series_key(election, settings, quick, catalog):
+    "Key of the stored series of an election, with the inputs of the models only, not the plotting code"
+    return input_hash(catalog.files_hash(), election, output_settings(settings), quick, modules=results_modules)
+
+def load_duo_probabilities(election, settings, quick):
+    """
+    Fill the duo probabilities memo with those stored with the time series
+    of an election, so that a new process (watch mode) only computes the dates
+    changed by new polls
+    """
+    catalog = DataCatalog(election).load()
+    series = results_store.get("{}-time-series".format(election["date_first_round"].year),
+                               time_series_key(election, settings, quick, catalog))
+    if series is not None:
+        duo_probabilities_memo.update(series["duo_probabilities"])
+
+def make_time_plot(election, settings, quick, manifest, catalog):
+    """
+    Time plot of an election, returns its filename and the images to render
+    (none if up to date in manifest), see render_images
+    The filename is a hash of the poll files, settings and code. Its series
+    are stored, and only computed again when the inputs change
+    """
+    year = election["date_first_round"].year
+
+    key = input_hash(catalog.files_hash(), election, output_settings(settings), quick)
+    filename_time_plot = "time-plot-{}-{}.png".format(year, key[:16])
+    path = join("public", filename_time_plot)
+    if manifest.up_to_date(path, key):
+        return filename_time_plot, []
+
+    series_key = time_series_key(election, settings, quick, catalog)
+    series = results_store.get("{}-time-series".format(year), series_key)
+    if series is None:
+        trace("Time election models...")
+        series = time_series(election, settings, quick, catalog)
+        results_store.put("{}-time-series".format(year), series_key, series)
+
+    return filename_time_plot, [(path, key, time_plot, (election, series["first_round"], series["second_round"], "linear"))]
+
+def remove_old_time_plots(year, filename_time_plot):
+    "Previous time plots of an election, not linked anymore"
+    for path in glob.glob(join("public", "time-plot-{}-*.png".format(year))):
+        if os.path.basename(path) != filename_time_plot:
+            os.remove(path)
+
+def election_job(election, settings, quick, manifest, catalog):
+    """
+    Context of an election and its images to render, see render_images
+    The main model and the time plot are made by the same job, so that they
+    share second round models
+    """
+    try:
+        context, violins = context_models(election, settings, catalog)
+        context["time_plot_path"], time_plot_images = make_time_plot(election, settings, quick, manifest, catalog)
+    finally:
+        # Second round models are only shared within an election, even if it failed
+        second_round_models.clear()
+
+    return context, violin_images(violins) + time_plot_images
+
+def context_full(election, settings, quick, manifest, executor=None):
+    """
+    Context of an election, rendering all its images that are not up to date
+    in manifest, on executor if given
+    """
+    # All poll files of the election, read once
+    catalog = DataCatalog(election).load()
+    context, images = election_job(election, settings, quick, manifest, catalog)
+
+    trace("Plots...")
+    manifest.update(render_images(images, manifest, executor))
+    remove_old_time_plots(election["date_first_round"].year, context["time_plot_path"])
 
     return context
 
-# settings is a read-only dict of parameters
 # context is a write-only dict for rendering
-default_settings = {
-    "number_of_samples_base": 5000000,
-    "number_of_samples_time_plot": 1000000,
-    "constant_precision": 400, # Equivalent sample size for a single poll on election day
-    "election_cycle_duration": 130, # parameter for the time coefficient, in days, None to not use a time factor
-    "keep_only_latest": True,
-    "show_n_duos": 5,
-}
-
 def render(env, template, target, context):
-    with open(target, "w") as f:
-        html = env.get_template(template).render(context)
-        f.write(html)
+    "Render a page, only written if its content changed"
+    html = env.get_template(template).render(context)
+    write_if_changed(target, html.encode("utf-8"))
+
+# Elections in navigation order, with the link and directory of their page
+election_pages = [
+    ("2002", "/2002/", join("public", "2002")),
+    ("2007", "/2007/", join("public", "2007")),
+    ("2012", "/2012/", join("public", "2012")),
+    ("2017", "/", "public"),
+]
+
+def make_environment():
+    env = Environment(loader=FileSystemLoader("templates"))
+    env.globals.update(get_candidate_color=exdata.candidates_colors.get)
+    return env
 
-def make_public(quick):
-    "Make public website"
+def render_election(env, year, context):
+    "Render the pages of an election"
+    years = [y for y, link, directory in election_pages]
+    i = years.index(year)
 
-    os.makedirs("public", exist_ok=True)
-    os.makedirs("public/methodologie", exist_ok=True)
-    os.makedirs("public/apropos", exist_ok=True)
-    os.makedirs("public/2002", exist_ok=True)
-    os.makedirs("public/2007", exist_ok=True)
-    os.makedirs("public/2012", exist_ok=True)
-    os.makedirs("public/violins", exist_ok=True)
+    previous_page, next_page = None, None
+    if i > 0:
+        previous_page = {"label": election_pages[i - 1][0], "link": election_pages[i - 1][1]}
+    if i + 1 < len(election_pages):
+        next_page = {"label": election_pages[i + 1][0], "link": election_pages[i + 1][1]}
+    context["nav"] = {"previous": previous_page, "next": next_page}
 
-    settings = default_settings
+    directory = election_pages[i][2]
+    render(env, "prediction.html", join(directory, "index.html"), context)
 
-    if quick:
-        settings["number_of_samples_base"] = 2000
+    # Other pages use the latest election
+    if i + 1 == len(election_pages):
+        render(env, "methodologie.html", join("public", "methodologie", "index.html"), context)
+        render(env, "apropos.html", join("public", "apropos", "index.html"), context)
 
-    context2002 = context_full(exdata.elections["2002"], settings, quick)
-    context2007 = context_full(exdata.elections["2007"], settings, quick)
-    context2012 = context_full(exdata.elections["2012"], settings, quick)
-    context2017 = context_full(exdata.elections["2017"], settings, quick)
+def make_settings(quick):
+    "Settings of a build, default_settings is left unchanged"
+    settings = dict(default_settings)
 
-    print("Rendering html...")
-    env = Environment(loader=FileSystemLoader("templates"))
-    env.globals.update(get_candidate_color=exdata.candidates_colors.get)
-
-    # Render 2002 prediction page
-    context2002["nav"] = {"previous": None, "next": {"label": "2007", "link": "/2007/"}}
-    render(env, "prediction.html", join("public", "2002", "index.html"), context2002)
+    if quick:
+        settings["number_of_samples_base"] = 2000
 
-    # Render 2007 prediction page
-    context2007["nav"] = {"previous": {"label": "2002", "link": "/2002/"}, "next": {"label": "2012", "link": "/2012/"}}
-    render(env, "prediction.html", join("public", "2007", "index.html"), context2007)
+    check_settings(settings)
+    return settings
+
+def copy_static():
+    "Copy static ressources, only those that changed"
+    for source, target in [("templates/style.css", "public/style.css"),
+                           ("templates/main.js", "public/main.js"),
+                           ("templates/email.js", "public/email.js"),
+                           ("web/logo_with_math.png", "public/logo.png")]:
+        with open(source, "rb") as f:
+            write_if_changed(target, f.read())
+
+def load_election(election):
+    "All poll files of an election, scanned and read once for all its jobs"
+    catalog = DataCatalog(election).load()
+    catalog.files_hash()
+    return catalog
+
+def render_page_job(year, election_result, images):
+    "Render the pages of an election once its images are done, returns its context"
+    context = election_result[0]
+    trace("Rendering {} html...".format(year))
+    render_election(make_environment(), year, context)
+    return context
 
-    # Render 2012 prediction page
-    context2012["nav"] = {"previous": {"label": "2007", "link": "/2007/"}, "next": {"label": "2017", "link": "/"}}
-    render(env, "prediction.html", join("public", "2012", "index.html"), context2012)
+def make_public(quick, keep_models=False):
+    """
+    Make public website
+    For each election, poll files are loaded, then models are made, then
+    each image is rendered, then pages. Jobs run as soon as they are ready,
+    concurrently on a process pool with the build_workers setting. Images
+    whose inputs didn't change are not made again, and files are only
+    written if their content changed
+    With keep_models, models are made in this process, so that its memos
+    are filled for later rebuilds (watch mode)
+    Returns contexts of all elections
+    """
 
-    # Render all 2017 pages
-    context2017["nav"] = {"previous": {"label": "2012", "link": "/2012/"}, "next": None}
-    render(env, "prediction.html", join("public", "index.html"), context2017)
-    render(env, "methodologie.html", join("public", "methodologie", "index.html"), context2017)
-    render(env, "apropos.html", join("public", "apropos", "index.html"), context2017)
+    os.makedirs("public", exist_ok=True)
+    os.makedirs("public/methodologie", exist_ok=True)
+    os.makedirs("public/apropos", exist_ok=True)
+    os.makedirs("public/2002", exist_ok=True)
+    os.makedirs("public/2007", exist_ok=True)
+    os.makedirs("public/2012", exist_ok=True)
+    os.makedirs("public/violins", exist_ok=True)
 
-    # Copy static ressources
-    shutil.copyfile("templates/style.css", "public/style.css")
-    shutil.copyfile("templates/main.js", "public/main.js")
-    shutil.copyfile("templates/email.js", "public/email.js")
-    shutil.copyfile("web/logo_with_math.png", "public/logo.png")
+    settings = make_settings(quick)
+    manifest = Manifest(manifest_filename)
+
+    def outdated(election_result):
+        "Images of an election that are not up to date, as arguments of render_image"
+        return [(path, plot) + tuple(args) for path, key, plot, args in election_result[1]
+                if not manifest.up_to_date(path, key)]
+
+    graph = TaskGraph()
+    graph.add("static", copy_static)
+    pgm_path, pgm_key, plot, args = pgm_image()
+    if not manifest.up_to_date(pgm_path, pgm_key):
+        graph.add("pgm", render_image, (pgm_path, plot) + args)
+    for year, link, directory in election_pages:
+        election = exdata.elections[year]
+        catalog = graph.add(("load", year), load_election, (election,))
+        election_result = graph.add(("election", year), election_job, (election, settings, quick, manifest), dependencies=[catalog],
+                                    local=keep_models)
+        images = graph.add_each(("images", year), render_image, election_result, outdated)
+        graph.add(("page", year), render_page_job, (year,), dependencies=[election_result, images])
+
+    if settings["build_workers"] > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=settings["build_workers"]) as executor:
+            results = graph.run(executor)
+    else:
+        results = graph.run()
+
+    # Jobs only make files, the manifest is written here once
+    manifest.update({pgm_path: pgm_key})
+    for year, link, directory in election_pages:
+        context, images = results[("election", year)]
+        manifest.update({path: key for path, key, plot, args in images})
+        remove_old_time_plots(year, context["time_plot_path"])
+    manifest.save()
+
+    return {year: results[("page", year)] for year, link, directory in election_pages}
+
+def poll_files_state(election):
+    "Modification time and size of each poll file of an election"
+    state = {}
+    with os.scandir(election["second_round_prefix"]) as entries:
+        for entry in entries:
+            if entry.is_file():
+                stat = entry.stat()
+                state[entry.name] = (stat.st_mtime_ns, stat.st_size)
+    return state
+
+def watch(quick, interval):
+    """
+    Make public website, then watch poll files and only rebuild the elections
+    whose files changed. Models and violins that don't depend on the changed
+    polls are not computed again
+    """
+    # State before building, so that changes made meanwhile are seen
+    states = {year: poll_files_state(exdata.elections[year]) for year, link, directory in election_pages}
+    contexts = make_public(quick, keep_models=True)
+    settings = make_settings(quick)
+
+    # Time series of the build may be stored ones, whose dates were not computed here
+    for year, link, directory in election_pages:
+        load_duo_probabilities(exdata.elections[year], settings, quick)
+
+    manifest = Manifest(manifest_filename)
+    env = make_environment()
+
+    # Plots of an election are rendered concurrently too
+    executor = None
+    if settings["build_workers"] > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=settings["build_workers"])
+
+    trace("Watching poll files...")
+    while True:
+        time.sleep(interval)
+        for year, link, directory in election_pages:
+            state = poll_files_state(exdata.elections[year])
+            if state == states[year]:
+                continue
+
+            trace("Poll files of {} changed".format(year))
+            begin = time.time()
+            try:
+                contexts[year] = context_full(exdata.elections[year], settings, quick, manifest, executor)
+                render_election(env, year, contexts[year])
+                manifest.save()
+            except Exception:
+                # E.g. a poll file being written, the rebuild is tried again on the next check
+                traceback.print_exc()
+                trace("{} not updated, will retry".format(year))
+                continue
+
+            states[year] = state
+            trace("{} updated in {:.1f} s".format(year, time.time() - begin))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Depuis 1958")
     parser.add_argument("--quick", action="store_true", help="Quick build")
+    parser.add_argument("--watch", action="store_true", help="Keep running and rebuild elections when their polls change")
+    parser.add_argument("--interval", type=float, default=10, help="Seconds between checks of poll files in watch mode")
     args = parser.parse_args()
 
-    make_public(args.quick)
+    if args.watch:
+        watch(args.quick, args.interval)
+    else:
+        make_public(args.quick)
@@ -1,37 +1,185 @@
 from os.path import join
 import os
+import hashlib
+import zipfile
 
 import numpy as np
-import pandas as pd
 import datetime
 
 from model import argsort, sortby, all_possible_second_rounds
 import exdata
 import os.path
 
-class Poll(object):
-    "A single election poll"
-    def __init__(self, obj):
-        self.institute = obj["sondeur"]
-        self.sample_size = obj["échantillon"]
+# Day numbers are proleptic Gregorian ordinals, as date.toordinal()
+epoch_day = datetime.date(1970, 1, 1).toordinal()
 
-        candidates = list(obj.index[5:])
-        values = list(obj.iloc[5:])
+def day_number(date):
+    return date.toordinal()
 
-        indexes = argsort(candidates, key=exdata.candidates_alphabetical_index.get)
-        self.candidates = sortby(candidates, indexes)
-        self.values = np.array(sortby(values, indexes))
+# pandas is slow to import, it is only imported to parse poll files (not
+# needed when they are cached) and to make dates for time plots
 
-        self.date = datetime.datetime.strptime(obj["date fin"], "%Y-%m-%d")
+def days_to_dates(days):
+    "DatetimeIndex of day numbers"
+    import pandas as pd
+    return pd.DatetimeIndex((np.asarray(days) - epoch_day).astype("datetime64[D]"))
 
-    def time_coeff(self, election_date, cycle_duration):
-        "Time coefficient of the poll"
-        cycle_begin = election_date - datetime.timedelta(days=cycle_duration)
-        return (self.date - cycle_begin).days / cycle_duration
+def day_numbers(dates):
+    "Day numbers of a DatetimeIndex"
+    return np.asarray(dates, dtype="datetime64[D]").astype(np.int64) + epoch_day
 
-def poll_list(data_frame):
-    "Parse a poll file into a list of polls, with optional fake_today"
-    return [Poll(p) for i, p in data_frame.iterrows()]
+class PollTable(object):
+    """
+    Polls of a file as columns, sorted by date (in file order for the same date)
+    values[k] are the shares of poll k (in %) in candidates order (alphabetical index),
+    days[k] the day number of its end date, institutes[k] a code in institute_names
+    and sources[k] a code in source_names
+    """
+    def __init__(self, candidates, values, days, institutes, institute_names, sources, source_names, latest=None):
+        self.candidates = candidates
+        self.values = values
+        self.days = days
+        self.institutes = institutes
+        self.institute_names = institute_names
+        self.sources = sources
+        self.source_names = source_names
+
+        # Latest poll of each institute among the first polls, see prefix_latest()
+        self._latest = latest
+
+    def __len__(self):
+        return len(self.days)
+
+    def __getitem__(self, rows):
+        "Table of some polls, rows being a slice, indexes or a boolean mask"
+        return PollTable(self.candidates, self.values[rows], self.days[rows], self.institutes[rows], self.institute_names,
+                         self.sources[rows], self.source_names)
+
+    def until(self, limit_date):
+        """
+        Polls ended on or before limit_date, found by binary search
+        The prefix structure of a prefix is a prefix of the structure: it is
+        built once by this table, and shared with all the tables returned
+        """
+        end = np.searchsorted(self.days, day_number(limit_date), side="right")
+        table = self[:end]
+        table._latest = self.prefix_latest()[:end + 1]
+        return table
+
+    def prefix_latest(self):
+        """
+        Matrix where [k, i] is the index of the latest poll of institute i among
+        the k first polls, or -1. Computed once, and shared with prefixes of the table
+        """
+        if self._latest is None:
+            # Candidates are the first poll of each institute and date
+            n, m = len(self), len(self.institute_names)
+            first = np.unique(self.days * m + self.institutes, return_index=True)[1]
+            latest = np.full((n + 1, m), -1, dtype=np.int64)
+            latest[first + 1, self.institutes[first]] = first
+
+            # Polls are sorted by date: the latest of the k first is the highest index
+            self._latest = np.maximum.accumulate(latest, axis=0)
+        return self._latest
+
+    def latest_per_institute(self):
+        "Indexes of the latest poll of each institute, the first in file order if several"
+        latest = self.prefix_latest()[len(self)]
+        return np.sort(latest[latest >= 0])
+
+    def time_coeffs(self, election_date, cycle_duration):
+        "Time coefficients of all polls"
+        cycle_begin = day_number(election_date) - cycle_duration
+        return (self.days - cycle_begin) / cycle_duration
+
+def parse_poll_file(filename):
+    import pandas as pd
+    return poll_table(pd.read_csv(filename))
+
+def poll_table(data_frame):
+    "Parse a poll file into a table"
+    import pandas as pd
+    candidates = sorted(data_frame.columns[5:], key=exdata.candidates_alphabetical_index.get)
+    values = data_frame[candidates].to_numpy(dtype=np.float64)
+    dates = pd.to_datetime(data_frame["date fin"], format="%Y-%m-%d").to_numpy().astype("datetime64[D]")
+    days = dates.astype(np.int64) + epoch_day
+    # Missing institutes and sources get their own code too ("nan"), not -1
+    institutes, institute_names = pd.factorize(data_frame["sondeur"], use_na_sentinel=False)
+    sources, source_names = pd.factorize(data_frame["source"], use_na_sentinel=False)
+    table = PollTable(candidates, values, days, institutes, [str(i) for i in institute_names],
+                      sources, [str(s) for s in source_names])
+    return table[np.argsort(days, kind="stable")]
+
+# Parsed poll files are cached here, None to always parse them
+poll_cache_directory = join("cache", "polls")
+
+# Changed whenever the cached format changes, to invalidate older files
+poll_cache_version = 4
+
+def file_hash(filename):
+    with open(filename, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def poll_cache_file(filename):
+    "Cache file of a poll file, named after its absolute path"
+    name = hashlib.sha256(os.path.abspath(filename).encode()).hexdigest()
+    return join(poll_cache_directory, name + ".npz")
+
+def read_poll_file(filename):
+    """
+    Table and content hash of a poll file, from the cache if still valid
+    The cache is valid for the same size and modification time, or if the
+    content hash is the same (e.g. the file was touched)
+    """
+    if poll_cache_directory is None:
+        return parse_poll_file(filename), file_hash(filename)
+
+    stat = os.stat(filename)
+    cache_file = poll_cache_file(filename)
+    table, content_hash = None, None
+    try:
+        with np.load(cache_file, allow_pickle=False) as cached:
+            if int(cached["version"]) == poll_cache_version and int(cached["size"]) == stat.st_size:
+                if int(cached["mtime"]) == stat.st_mtime_ns:
+                    return cached_poll_table(cached), str(cached["hash"])
+
+                # Modified or touched, still valid if the content is the same
+                content_hash = file_hash(filename)
+                if str(cached["hash"]) == content_hash:
+                    table = cached_poll_table(cached)
+    except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+        # Missing, truncated or unreadable cache file
+        pass
+
+    if table is None:
+        table = parse_poll_file(filename)
+    if content_hash is None:
+        content_hash = file_hash(filename)
+
+    # Written to a temporary file first, so that readers never see a partial file
+    try:
+        os.makedirs(poll_cache_directory, exist_ok=True)
+        temporary_file = cache_file + ".{}.tmp.npz".format(os.getpid())
+        np.savez(temporary_file, version=poll_cache_version, size=stat.st_size, mtime=stat.st_mtime_ns, hash=content_hash,
+                 candidates=np.array(table.candidates, dtype=str), values=table.values, days=table.days,
+                 institutes=table.institutes, institute_names=np.array(table.institute_names, dtype=str),
+                 sources=table.sources, source_names=np.array(table.source_names, dtype=str))
+        os.replace(temporary_file, cache_file)
+    except OSError:
+        # Not cached, e.g. read-only directory
+        pass
+    return table, content_hash
+
+def cached_poll_table(cached):
+    "Table of a loaded cache file"
+    return PollTable([str(c) for c in cached["candidates"]], cached["values"], cached["days"],
+                     cached["institutes"], [str(i) for i in cached["institute_names"]],
+                     cached["sources"], [str(s) for s in cached["source_names"]])
+
+def empty_poll_table(candidates):
+    "Table without any poll"
+    no_codes = np.zeros(0, dtype=np.int64)
+    return PollTable(candidates, np.zeros((0, len(candidates))), np.zeros(0, dtype=np.int64), no_codes, [], no_codes, [])
 
 def second_round_poll_file(prefix, duo):
     candidates = list(duo)
@@ -40,44 +188,138 @@ def second_round_poll_file(prefix, duo):
     c1, c2 = candidates
     return join(prefix, "second-tour-{}-{}.csv".format(exdata.candidates_shortnames[c1], exdata.candidates_shortnames[c2]))
 
+class DataCatalog(object):
+    """
+    Poll files of an election, found with a single scan of its directory
+    Each file is read once, and shared by all first round hypotheses and pages
+    """
+    def __init__(self, election):
+        self.election = election
+        self.directory = election["second_round_prefix"]
+
+        # Names of all entries, and of those that are files with their modification time
+        self.names = []
+        self.files = set()
+        self.modification_times = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                self.names.append(entry.name)
+                if entry.is_file():
+                    self.files.add(entry.name)
+                    self.modification_times[entry.name] = entry.stat().st_mtime
+        self.names.sort()
+
+        # Tables and content hashes of the files read
+        self.tables = {}
+        self.hashes = {}
+        self._files_hash = None
+
+    def table(self, filename):
+        "Table of a poll file, read on first use"
+        if filename not in self.tables:
+            self.tables[filename], self.hashes[filename] = read_poll_file(filename)
+        return self.tables[filename]
+
+    def load(self):
+        """
+        Read all poll files used by the models of the election, e.g. before
+        sending the catalog to other processes
+        """
+        for table in self.first_round_tables():
+            for duo in all_possible_second_rounds(table.candidates):
+                self.second_round_table(duo)
+        return self
+
+    def second_round_table(self, duo):
+        "Table of the second round poll file of a duo, None if there is none"
+        poll_file = second_round_poll_file(self.directory, duo)
+        if os.path.basename(poll_file) not in self.files:
+            return None
+        return self.table(poll_file)
+
+    def first_round_tables(self):
+        "Tables of all first round hypotheses"
+        return [self.table(filename) for date, filename in self.election["first_round_filenames"]]
+
+    def sources(self):
+        """
+        Sources of all first round polls, and of second round polls of the
+        candidates of the last hypothesis
+        """
+        sources = set()
+        for table in self.first_round_tables():
+            sources.update(table.source_names)
+
+        for duo in all_possible_second_rounds(self.first_round_tables()[-1].candidates):
+            table = self.second_round_table(duo)
+            if table is not None:
+                sources.update(table.source_names)
+        return sources
+
+    def last_modified(self):
+        "Date of the latest change of a poll file, None if there are none"
+        if not self.modification_times:
+            return None
+        return datetime.datetime.fromtimestamp(max(self.modification_times.values()))
+
+    def files_hash(self):
+        """
+        Hash of the names and contents of all poll files used by the models,
+        computed once from the hashes kept in the poll cache
+        """
+        if self._files_hash is None:
+            self.load()
+            digest = hashlib.sha256()
+            for filename in sorted(self.hashes):
+                digest.update(os.path.basename(filename).encode())
+                digest.update(self.hashes[filename].encode())
+            self._files_hash = digest.hexdigest()
+        return self._files_hash
+
+    def listing(self):
+        "Names and paths of all entries of the directory, sorted by name"
+        return [(name, join(self.directory, name)) for name in self.names]
+
 class PollCollection(object):
-    "All polls (both rounds) related to a given election and first round hypothesis"
-    def __init__(self, election, first_round_filename):
+    """
+    All polls (both rounds) related to a given election and first round hypothesis
+    Files are read through catalog, a new DataCatalog of the election if None
+    """
+    def __init__(self, election, first_round_filename, catalog=None):
+        if catalog is None:
+            catalog = DataCatalog(election)
+
         # First round, get list of candidates and parse polls
-        first_round_data = pd.read_csv(first_round_filename)
-        self.candidates = sorted(first_round_data.columns[5:], key=exdata.candidates_alphabetical_index.get)
-        self.polls_first_round = poll_list(first_round_data)
+        self.polls_first_round = catalog.table(first_round_filename)
+        self.candidates = self.polls_first_round.candidates
 
         # Second round
         self.polls_second_round = {}
         for duo in all_possible_second_rounds(self.candidates):
             # See if a poll file exists and contains valid polls
-            poll_file = second_round_poll_file(election["second_round_prefix"], duo)
-            if os.path.isfile(poll_file):
-                second_round_data = pd.read_csv(poll_file)
-                self.polls_second_round[duo] = poll_list(second_round_data)
+            table = catalog.second_round_table(duo)
+            if table is not None:
+                self.polls_second_round[duo] = table
             else:
-                self.polls_second_round[duo] = []
+                candidates = sorted(duo, key=exdata.candidates_alphabetical_index.get)
+                self.polls_second_round[duo] = empty_poll_table(candidates)
 
     def fake_today_poll_dates(self):
         """
         Sorted list of unique dates where new polls are available
         starting on the first available first round poll
         """
-        poll_dates = [poll.date for poll in self.polls_first_round]
-        first = min(poll_dates)
-        for sr in self.polls_second_round.values():
-            poll_dates.extend([poll.date for poll in sr])
+        days = np.concatenate([self.polls_first_round.days] + [sr.days for sr in self.polls_second_round.values()])
 
         # Don't consider a date if no first round poll available
-        poll_dates = [date for date in poll_dates if date >= first]
-        return pd.DatetimeIndex(sorted(list(set(poll_dates))))
+        days = days[days >= np.min(self.polls_first_round.days)]
+        return days_to_dates(np.unique(days))
 
     def get_first_rounds(self, limit_date):
-        return [p for p in self.polls_first_round if p.date <= limit_date]
+        return self.polls_first_round.until(limit_date)
 
     def get_second_rounds(self, duo, limit_date):
-        return [p for p in self.polls_second_round[duo] if p.date <= limit_date]
+        return self.polls_second_round[duo].until(limit_date)
 
     def number_of_first_round_polls(self):
         "Total number of valid first round polls in the collection"
@@ -85,4 +327,4 @@ class PollCollection(object):
 
     def number_of_second_round_polls(self):
         "Total number of valid second round polls in the collection"
-        return sum([len(poll_list) for poll_list in self.polls_second_round.values()])
+        return sum([len(poll_table) for poll_table in self.polls_second_round.values()])
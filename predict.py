@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Model only command line, printing probabilities as JSON
+# Only what the model needs is imported (no plotting nor templates), to start fast
+# The numpy sampler is used by default, the scipy one imports scipy.stats
+
+import argparse
+import datetime
+import json
+
+import numpy as np
+
+import exdata
+from polls import PollCollection
+from election import ElectionModel
+from settings import default_settings, check_settings
+
+def predict(election, limit_date, settings, hypothesis=-1):
+    "Probabilities of the model with polls up to limit_date, as a dict of plain values"
+    first_round_filename = election["first_round_filenames"][hypothesis][1]
+    poll_collection = PollCollection(election, first_round_filename)
+    election_model = ElectionModel(election, poll_collection, limit_date, settings["number_of_samples_base"], settings)
+    model = election_model.model_first_round
+
+    # Most likely first
+    total = sorted(election_model.total_win_probability().items(), key=lambda x: -x[1])
+    duos = sorted(model.probability_duos().items(), key=lambda x: -x[1])
+
+    depth = model.size if settings["rank_depth"] is None else min(settings["rank_depth"], model.size)
+    ranks = np.array([model.probability_rank(rank) for rank in range(depth)]).T
+
+    return {
+        "date": limit_date.strftime("%Y-%m-%d"),
+        "first_round_filename": first_round_filename,
+        "number_of_samples": settings["number_of_samples_base"],
+        "total_win_probability": {c: float(p) for c, p in total},
+        "duo_probabilities": [{"candidates": sorted(duo, key=exdata.candidates_alphabetical_index.get), "probability": float(p)}
+                              for duo, p in duos],
+        "rank_probabilities": {c: [float(p) for p in ranks[i]] for i, c in enumerate(model.candidates)},
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Depuis 1958, model probabilities as JSON")
+    parser.add_argument("--year", required=True, choices=sorted(exdata.elections.keys()), help="Election year")
+    parser.add_argument("--date", help="Only use polls up to this date (YYYY-MM-DD), default all polls")
+    parser.add_argument("--hypothesis", type=int, default=-1, help="Index of the first round hypothesis, default the latest")
+    parser.add_argument("--samples", type=int, help="Number of samples, default number_of_samples_base")
+    parser.add_argument("--rank-depth", type=int, help="Number of ranks of rank_probabilities, default all of them")
+    parser.add_argument("--sampler", default="numpy", choices=["numpy", "scipy", "sobol"], help="Sampler, default numpy (scipy, as the website, is slower to import)")
+    parser.add_argument("--indent", type=int, help="Indent JSON output")
+    args = parser.parse_args()
+    if args.rank_depth is not None and args.rank_depth < 2:
+        parser.error("--rank-depth must be at least 2, the ranks of the two first make the duo probabilities")
+
+    settings = dict(default_settings, rank_depth=args.rank_depth, sampler=args.sampler)
+    if args.samples is not None:
+        settings["number_of_samples_base"] = args.samples
+    # Only the ranks asked for are used
+    check_settings(settings, least_rank_depth=2)
+
+    election = exdata.elections[args.year]
+    if args.date is None:
+        limit_date = election["date_second_round"]
+    else:
+        limit_date = datetime.datetime.strptime(args.date, "%Y-%m-%d")
+
+    print(json.dumps(predict(election, limit_date, settings, args.hypothesis), ensure_ascii=False, indent=args.indent))
@@ -0,0 +1,205 @@
+import warnings
+
+import numpy as np
+import scipy.special
+
+def scipy_stats():
+    "scipy.stats, slow to import, so only imported when needed"
+    import scipy.stats
+    return scipy.stats
+
+# Samplers with a replicate_size draw correlated samples (less variance), each
+# draw being an independent replicate used to estimate the error. Models draw
+# them replicate_size samples at a time by default.
+
+class ScipySampler(object):
+    "Dirichlet samples from scipy, using numpy's legacy global random state"
+    replicate_size = None
+
+    def draw(self, weights, number_of_samples, reuse_buffer=False):
+        return scipy_stats().dirichlet.rvs(weights, size=number_of_samples)
+
+    def spawn(self, n):
+        raise ValueError("The scipy sampler has no independent streams for parallel sampling, use the numpy sampler")
+
+    def gamma_batch(self, weights, number_of_samples):
+        raise ValueError("The scipy sampler can't sample many models at once, use the numpy sampler")
+
+class GammaSampler(object):
+    """
+    Dirichlet samples as normalized gamma variates from a numpy Generator
+    With reuse_buffer, samples are drawn in place in a buffer kept between draws,
+    so they are only valid until the next draw
+    """
+    replicate_size = None
+
+    def __init__(self, seed=None, dtype=np.float64):
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seed_sequence = seed
+        self.rng = np.random.Generator(np.random.PCG64(seed))
+        self.dtype = np.dtype(dtype)
+
+        self._buffer = None
+        self._norms = None
+
+    def spawn(self, n):
+        "n independent child samplers, e.g. one per worker process"
+        return [GammaSampler(seed, self.dtype) for seed in self.seed_sequence.spawn(n)]
+
+    def buffers(self, number_of_samples, size):
+        "Reusable sample and normalization buffers, grown when needed"
+        if self._buffer is None or self._buffer.shape[0] < number_of_samples or self._buffer.shape[1] != size:
+            self._buffer = np.empty((number_of_samples, size), dtype=self.dtype)
+            self._norms = np.empty((number_of_samples, 1), dtype=self.dtype)
+        return self._buffer[:number_of_samples], self._norms[:number_of_samples]
+
+    def draw(self, weights, number_of_samples, reuse_buffer=False):
+        size = len(weights)
+        if reuse_buffer:
+            samples, norms = self.buffers(number_of_samples, size)
+        else:
+            samples = np.empty((number_of_samples, size), dtype=self.dtype)
+            norms = np.empty((number_of_samples, 1), dtype=self.dtype)
+
+        # Dirichlet(a) is the distribution of independent Gamma(a_i, 1) divided by their sum
+        self.rng.standard_gamma(weights, dtype=self.dtype, out=samples)
+        np.sum(samples, axis=1, keepdims=True, out=norms)
+        samples /= norms
+        return samples
+
+    def gamma_batch(self, weights, number_of_samples):
+        """
+        Independent Gamma(w, 1) variates for each row w of weights, in one call
+        Shape is (rows, number_of_samples, columns). Not normalized, but they rank
+        like samples of the Dirichlet distributions
+        """
+        rows, size = weights.shape
+        return self.rng.standard_gamma(weights[:, np.newaxis, :], size=(rows, number_of_samples, size), dtype=self.dtype)
+
+class InverseGammaSampler(object):
+    """
+    Dirichlet samples from uniforms through the inverse CDF of gamma variates
+    Uniforms are independent, subclasses choose them to reduce variance
+    """
+    replicate_size = 2**14
+
+    def __init__(self, seed=None, dtype=np.float64):
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seed_sequence = seed
+        self.rng = np.random.Generator(np.random.PCG64(seed))
+        self.dtype = np.dtype(dtype)
+
+    def spawn(self, n):
+        return [type(self)(seed, self.dtype) for seed in self.seed_sequence.spawn(n)]
+
+    def uniforms(self, number_of_samples, size):
+        return self.rng.random((number_of_samples, size))
+
+    def draw(self, weights, number_of_samples, reuse_buffer=False):
+        uniforms = self.uniforms(number_of_samples, len(weights))
+
+        # Stay away from 0 and 1, where gamma variates are 0 or infinite
+        np.clip(uniforms, np.finfo(np.float64).tiny, 1 - np.finfo(np.float64).epsneg, out=uniforms)
+
+        samples = scipy.special.gammaincinv(weights, uniforms).astype(self.dtype, copy=False)
+        samples /= np.sum(samples, axis=1, keepdims=True)
+        return samples
+
+    def gamma_batch(self, weights, number_of_samples):
+        "Same as GammaSampler.gamma_batch, each row using the next uniforms of the sequence"
+        rows, size = weights.shape
+        uniforms = self.uniforms(rows * number_of_samples, size).reshape((rows, number_of_samples, size))
+        np.clip(uniforms, np.finfo(np.float64).tiny, 1 - np.finfo(np.float64).epsneg, out=uniforms)
+        return scipy.special.gammaincinv(weights[:, np.newaxis, :], uniforms).astype(self.dtype, copy=False)
+
+class SobolSampler(InverseGammaSampler):
+    "Randomized quasi-Monte Carlo: each draw is a new scrambling of a Sobol sequence"
+    def uniforms(self, number_of_samples, size):
+        engine = scipy_stats().qmc.Sobol(size, scramble=True, seed=self.rng)
+        with warnings.catch_warnings():
+            # Balance properties are best with a power of 2, which replicate_size is,
+            # but the last block of a model may be smaller
+            warnings.simplefilter("ignore", UserWarning)
+            return engine.random(number_of_samples)
+
+class CommonUniforms(object):
+    """
+    Base uniforms shared by several samplers (common random numbers)
+    The k-th block drawn by any CommonSampler is the same: it is drawn again
+    on demand by a base sampler with its own stream, derived from the seed and
+    k, so that no block is kept in memory
+    """
+    def __init__(self, base, seed):
+        self.base = base
+        self.seed = seed
+        self.replicate_size = base.replicate_size
+
+    def block(self, index, number_of_samples, size):
+        "Uniforms of block index"
+        seed = np.random.SeedSequence(self.seed.entropy, spawn_key=self.seed.spawn_key + (index,))
+        return self.base(seed).uniforms(number_of_samples, size)
+
+class CommonSampler(InverseGammaSampler):
+    """
+    Samples of each model transform the same shared uniforms with its own
+    parameters, so that estimates of close models (e.g. successive dates) are
+    correlated and their differences have little noise
+    """
+    def __init__(self, common_uniforms, dtype=np.float64):
+        self.common_uniforms = common_uniforms
+        self.replicate_size = common_uniforms.replicate_size
+        self.dtype = np.dtype(dtype)
+
+        # Index of the next block
+        self.position = 0
+
+    def spawn(self, n):
+        raise ValueError("Common random numbers can't be drawn by several processes, use a single worker")
+
+    def uniforms(self, number_of_samples, size):
+        uniforms = self.common_uniforms.block(self.position, number_of_samples, size)
+        self.position += 1
+        return uniforms
+
+    def gamma_batch(self, weights, number_of_samples):
+        "Same as GammaSampler.gamma_batch, all rows transforming the same uniforms"
+        uniforms = self.uniforms(number_of_samples, weights.shape[1])
+        np.clip(uniforms, np.finfo(np.float64).tiny, 1 - np.finfo(np.float64).epsneg, out=uniforms)
+        return scipy.special.gammaincinv(weights[:, np.newaxis, :], uniforms).astype(self.dtype, copy=False)
+
+def make_common_uniforms(settings, spawn_key=()):
+    "Shared uniforms for common random numbers, from the sampler chosen by settings"
+    samplers = {
+        "numpy": InverseGammaSampler,
+        "sobol": SobolSampler,
+    }
+
+    if settings["sampler"] not in samplers:
+        raise ValueError("No common random numbers with sampler: {}".format(settings["sampler"]))
+    seed = np.random.SeedSequence(settings["seed"], spawn_key=spawn_key)
+    return CommonUniforms(samplers[settings["sampler"]], seed)
+
+def make_sampler(settings, spawn_key=(), common_uniforms=None):
+    """
+    Sampler chosen by settings
+    spawn_key identifies the model, so that each model gets its own reproducible
+    random stream, independent of the order in which models are built
+    With common_uniforms, the model draws them instead of its own stream
+    """
+    samplers = {
+        "numpy": GammaSampler,
+        "sobol": SobolSampler,
+    }
+
+    dtype = np.float32 if settings["float32"] else np.float64
+    if common_uniforms is not None:
+        return CommonSampler(common_uniforms, dtype)
+    elif settings["sampler"] == "scipy":
+        return ScipySampler()
+    elif settings["sampler"] in samplers:
+        seed = np.random.SeedSequence(settings["seed"], spawn_key=spawn_key)
+        return samplers[settings["sampler"]](seed, dtype)
+    else:
+        raise ValueError("Unknown sampler: {}".format(settings["sampler"]))
@@ -0,0 +1,56 @@
+# settings is a read-only dict of parameters, see check_settings for those that can't be used together
+default_settings = {
+    "number_of_samples_base": 5000000,
+    "number_of_samples_time_plot": 1000000,
+    "constant_precision": 400, # Equivalent sample size for a single poll on election day
+    "election_cycle_duration": 130, # parameter for the time coefficient, in days, None to not use a time factor
+    "keep_only_latest": True,
+    "show_n_duos": 5,
+    "block_size": None, # Draw samples this many at a time to bound memory use, None to draw all at once
+    "rank_depth": 3, # Number of first round ranks computed, at least 3, None for all
+    "sampler": "scipy", # "scipy" (legacy global random state), "numpy" (fast, reproducible) or "sobol" (less variance)
+    "seed": 1958, # Random seed of all samplers but "scipy", None for a different run each time
+    "float32": False, # Draw single precision samples with all samplers but "scipy", half the memory
+    "workers": 1, # Number of processes drawing samples of a model in parallel, not with the "scipy" sampler, common_random_numbers or build_workers
+    "target_error": None, # Stop sampling once all rank and duo probabilities have this standard error (e.g. 0.0005), None to always draw all samples
+    "sample_budget": None, # With target_error, total number of samples shared by all dates of a time plot, None for no limit, not with time_workers or batched_time_sweep
+    "quadrature_tolerance": None, # Integrate rank and duo probabilities numerically to this tolerance (e.g. 1e-6) instead of sampling, None to sample
+    "batched_time_sweep": False, # Sample all dates of a time plot at once (number_of_samples_time_plot each), not with the "scipy" sampler
+    "time_workers": 1, # Number of processes computing the dates of a time plot in parallel, not with the "scipy" sampler, common_random_numbers or build_workers
+    "build_workers": 1, # Number of processes running independent jobs of the website build (elections, then each image), 1 to run them in order, not with workers or time_workers
+    "common_random_numbers": False, # All dates of a time plot transform the same base uniforms, for smooth curves with fewer samples, not with the "scipy" sampler, workers or time_workers
+}
+
+def check_settings(settings, least_rank_depth=3):
+    """
+    Raise ValueError for settings that can't be used together, before any model is computed
+    least_rank_depth is the number of ranks used, 3 for pages (probability of being third)
+    """
+    if settings["sampler"] not in ["scipy", "numpy", "sobol"]:
+        raise ValueError("Unknown sampler: {}".format(settings["sampler"]))
+
+    if settings["rank_depth"] is not None and settings["rank_depth"] < least_rank_depth:
+        raise ValueError("rank_depth must be at least {}, or None for all ranks".format(least_rank_depth))
+
+    # Nothing is sampled by first round models in quadrature mode
+    sampled = settings["quadrature_tolerance"] is None
+    if settings["sampler"] == "scipy":
+        # Its legacy global random state has no independent streams, and draws one model at a time
+        if sampled and (settings["workers"] > 1 or settings["time_workers"] > 1):
+            raise ValueError("The scipy sampler has no independent streams for workers or time_workers, use the numpy sampler")
+        if sampled and settings["batched_time_sweep"]:
+            raise ValueError("The scipy sampler can't sample many models at once for batched_time_sweep, use the numpy sampler")
+        if settings["common_random_numbers"]:
+            raise ValueError("The scipy sampler has no common random numbers, use the numpy sampler")
+
+    if settings["common_random_numbers"] and (settings["workers"] > 1 or settings["time_workers"] > 1):
+        raise ValueError("Common random numbers can't be shared by several processes, set workers and time_workers to 1")
+
+    # Dates of a time plot computed in parallel or at once don't share a sample budget
+    keep_parameters = settings["batched_time_sweep"] or settings["time_workers"] > 1
+    if keep_parameters and settings["target_error"] is not None and settings["sample_budget"] is not None:
+        raise ValueError("A sample budget can't be shared by time_workers or batched_time_sweep, set sample_budget to None")
+
+    # Jobs of the build would each start their own pools of workers
+    if settings["build_workers"] > 1 and (settings["time_workers"] > 1 or settings["workers"] > 1):
+        raise ValueError("Models can't be computed in parallel by build jobs, set workers and time_workers, or build_workers to 1")
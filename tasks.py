@@ -0,0 +1,87 @@
+from collections import OrderedDict
+import concurrent.futures
+
+class TaskGraph(object):
+    """
+    Jobs depending on the results of other jobs
+    Each job runs as soon as its dependencies are done, on an executor (e.g. a
+    process pool), or one after another in this process without executor
+    """
+    def __init__(self):
+        self.tasks = OrderedDict()
+        self.local = set()
+
+    def add(self, name, function, args=(), dependencies=(), local=False):
+        """
+        Job calling function(*args, *results of dependencies)
+        Without executor, jobs run in the order they are added
+        Local jobs always run in this process, e.g. to fill its caches
+        """
+        for dependency in dependencies:
+            assert dependency in self.tasks, "Dependency {} must be added before {}".format(dependency, name)
+        self.tasks[name] = (function, args, dependencies, None)
+        if local:
+            self.local.add(name)
+        return name
+
+    def add_each(self, name, function, dependency, select=None):
+        """
+        One job calling function(*item) for each item of the result of
+        dependency, or of select(result) if given (select runs in this process)
+        The result of the task is the list of the results of its jobs
+        """
+        assert dependency in self.tasks, "Dependency {} must be added before {}".format(dependency, name)
+        self.tasks[name] = (function, (), (dependency,), select or (lambda result: result))
+        return name
+
+    def calls(self, task, results):
+        "Arguments of each job of a task, once its dependencies are done"
+        function, args, dependencies, select = task
+        if select is None:
+            return [tuple(args) + tuple(results[d] for d in dependencies)]
+        return [tuple(item) for item in select(results[dependencies[0]])]
+
+    def run(self, executor=None):
+        "Run all jobs, returns the results of tasks by name"
+        results = {}
+
+        if executor is None:
+            for name, task in self.tasks.items():
+                values = [task[0](*call) for call in self.calls(task, results)]
+                results[name] = values if task[3] is not None else values[0]
+            return results
+
+        pending = OrderedDict(self.tasks)
+        running = {}
+        # Results of the jobs of each running task, and number of jobs not done
+        values = {}
+        remaining = {}
+        while pending or running:
+            # Submit all jobs that are ready
+            for name, task in list(pending.items()):
+                if all(d in results for d in task[2]):
+                    del pending[name]
+                    calls = self.calls(task, results)
+                    values[name] = [None] * len(calls)
+                    remaining[name] = len(calls)
+                    if not calls:
+                        results[name] = []
+                    if name in self.local:
+                        # Jobs of other tasks keep running meanwhile
+                        results[name] = task[0](*calls[0])
+                        continue
+                    for k, call in enumerate(calls):
+                        running[executor.submit(task[0], *call)] = (name, k)
+
+            if not running:
+                continue
+
+            done, not_done = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name, k = running.pop(future)
+                values[name][k] = future.result()
+                remaining[name] -= 1
+                if remaining[name] == 0:
+                    results[name] = values[name] if self.tasks[name][3] is not None else values[name][0]
+
+        return results